@@ -0,0 +1,62 @@
+import os
+from openai import AsyncOpenAI, OpenAI
+from mock_server import MOCK_API, AsyncFakeClient, FakeClient, MockModel
+from response_cache import AsyncCachedClient, CachedClient, ResponseCache
+
+CACHE_PATH = "cache/responses.sqlite"
+MOCK_CACHE_PATH = "cache/mock-responses.sqlite"  # mock answers never mix with real ones
+
+_cache = None
+
+def read_api_key(filename="../api/openaikey.txt"):
+    try:
+        with open(filename, 'r') as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Please create a {filename} file with your OpenAI API key")
+    except Exception as e:
+        raise Exception(f"Error reading API key: {e}")
+
+def mock_api():
+    """
+    What the clients made here talk to instead of the API, from the MOCK_API
+    environment variable: "fake" for an in-process mock_server.FakeClient
+    (configured by MOCK_LATENCY, MOCK_ERROR_RATE, ... see MockModel.from_env),
+    the base URL of a running mock server, or None for the real API.
+
+        MOCK_API=fake python lisp_tests.py
+        python mock_server.py --corruption 0.2 --run lisp_tests
+    """
+    return os.environ.get(MOCK_API) or None
+
+def response_cache() -> ResponseCache:
+    """The response cache shared by every client made here, opened on first use."""
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(MOCK_CACHE_PATH if mock_api() else CACHE_PATH)
+    return _cache
+
+def get_client(cache: bool = True):
+    """An OpenAI client, answering repeated requests from the response cache unless cache is False."""
+    mock = mock_api()
+    if mock == "fake":
+        client = FakeClient(MockModel.from_env())
+    elif mock:
+        client = OpenAI(api_key="mock", base_url=mock)
+    else:
+        client = OpenAI(api_key=read_api_key())
+    return CachedClient(client, response_cache()) if cache else client
+
+def get_async_client(cache: bool = True):
+    """
+    An AsyncOpenAI client, cached like get_client(). Make one per event loop,
+    e.g. async with get_async_client() as client: ...
+    """
+    mock = mock_api()
+    if mock == "fake":
+        client = AsyncFakeClient(MockModel.from_env())
+    elif mock:
+        client = AsyncOpenAI(api_key="mock", base_url=mock)
+    else:
+        client = AsyncOpenAI(api_key=read_api_key())
+    return AsyncCachedClient(client, response_cache()) if cache else client
@@ -1,28 +1,19 @@
-from openai import OpenAI
-from expressions import Number, Add, Sub, Mul, Div, Expr
+from api_client import get_client
+from expressions import Expr
+from code_parser import parse_code
+from generators import generate_expression
+from ir import ExprIR
 import matplotlib.pyplot as plt
 
-def read_api_key(filename="../api/openaikey.txt"):
-    try:
-        with open(filename, 'r') as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Please create a {filename} file with your OpenAI API key")
-    except Exception as e:
-        raise Exception(f"Error reading API key: {e}")
-
-# Setup OpenAI client
-api_key = read_api_key()
-client = OpenAI(api_key=api_key)
+# Setup OpenAI client; repeated requests are answered from the on-disk response cache
+client = get_client()
 
 def test_expression_reconstruction(expr: Expr, test_words: bool = False) -> bool:
     system_message = open("prompts/exp_gpt_prompt.txt").read()
     expression_code_str = None  # Initialize the variable before try block
-    
-    try:
-        str_expr = str(expr)
-        words = expr.to_words()
+    str_expr = str(expr)
 
+    try:
         # Test string representation
         response_str = client.chat.completions.create(
             model="gpt-4o-mini-2024-07-18",
@@ -36,6 +27,7 @@ def test_expression_reconstruction(expr: Expr, test_words: bool = False) -> bool
 
         if test_words:
             # Test word representation
+            words = ExprIR.from_expr(expr).to_words()
             response_words = client.chat.completions.create(
                 model="o1-mini",
                 messages=[
@@ -47,24 +39,24 @@ def test_expression_reconstruction(expr: Expr, test_words: bool = False) -> bool
 
             expression_code_words = response_words.choices[0].message.content.strip()
 
-            expr_nums = eval(expression_code_str, {"Number": Number, "Add": Add, "Sub": Sub, "Mul": Mul, "Div": Div})
-            expr_words = eval(expression_code_words, {"Number": Number, "Add": Add, "Sub": Sub, "Mul": Mul, "Div": Div})
+            expr_nums = parse_code(expression_code_str)
+            expr_words = parse_code(expression_code_words)
 
             try:
                 if (expr_nums.eval() != expr.eval() or str(expr_nums) != str(expr)
-                    or expr_words.eval() != expr.eval() or expr_words.to_words() != expr.to_words()):
+                    or expr_words.eval() != expr.eval() or ExprIR.from_expr(expr_words).to_words() != words):
                     print("\nOriginal expression:", str_expr)
                     print("Word format:", words)
                     print("\nAPI Response for string format:", expression_code_str)
                     print("API Response for word format:", expression_code_words)
                     print("Constructed expression from string:", str(expr_nums))
-                    print("Constructed expression from words:", expr_words.to_words())
+                    print("Constructed expression from words:", ExprIR.from_expr(expr_words).to_words())
                     return False
                 return True
             except ZeroDivisionError:
                 return True
         else: 
-           expr_nums = eval(expression_code_str, {"Number": Number, "Add": Add, "Sub": Sub, "Mul": Mul, "Div": Div})
+           expr_nums = parse_code(expression_code_str)
            try:
                if (expr_nums.eval() != expr.eval() or str(expr_nums) != str(expr)):
                     print("\nOriginal expression:", str_expr)
@@ -84,25 +76,7 @@ def test_expression_reconstruction(expr: Expr, test_words: bool = False) -> bool
         return False
 
 def generate_random_ast(max_depth=4) -> Expr:
-    import random
-    
-    # Base case: always use Number constructor
-    if max_depth <= 1:
-        return Number(random.randint(1, 10))
-    
-    # For non-base cases, always create a nested expression
-    operators = [Add, Sub, Mul, Div]
-    op = random.choice(operators)
-    
-    # Both left and right should be expressions
-    left = generate_random_ast(max_depth - 1)
-    right = generate_random_ast(max_depth - 1)
-    
-    # Avoid division by zero
-    if op == Div and isinstance(right, Number) and right.value == 0:
-        right = Number(random.randint(1, 10))
-            
-    return op(left, right)
+    return generate_expression(max_depth).tree
 
 # Test with 25 random ASTs for each depth K from 1 to 7
 def run_tests(num_tests=25, test_words=True):  
@@ -117,7 +91,7 @@ def run_tests(num_tests=25, test_words=True):
         for i in range(num_tests):
             print(f"\nTest {i + 1}/{num_tests} for K={k}")
             ast = generate_random_ast(max_depth=k)
-            if test_expression_reconstruction(ast):
+            if test_expression_reconstruction(ast, test_words):
                 successes += 1
             else:
                 failures += 1
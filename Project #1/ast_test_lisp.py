@@ -1,23 +1,13 @@
-from openai import OpenAI
+from api_client import get_client
 import matplotlib.pyplot as plt
-import random
-from lisp_ast import tokenize, read_from_tokens, eval, convert_to_infix, parse
+from lisp_ast import eval, convert_to_infix, parse
+from generators import generate_expression
 
-def read_api_key(filename="../api/openaikey.txt"):
-    try:
-        with open(filename, 'r') as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Please create a {filename} file with your OpenAI API key")
-    except Exception as e:
-        raise Exception(f"Error reading API key: {e}")
-
-# Setup OpenAI client
-api_key = read_api_key()
-client = OpenAI(api_key=api_key)
+# Setup OpenAI client; repeated requests are answered from the on-disk response cache
+client = get_client()
 
 def test_expression_reconstruction(lisp_expr: str) -> bool:
-    system_message = open("prompts/exp_prompts/gpt_prompt.txt").read()
+    system_message = open("prompts/lisp_gpt_prompt.txt").read()
 
     try:
         # Convert Lisp expression to infix notation for GPT
@@ -48,23 +38,7 @@ def test_expression_reconstruction(lisp_expr: str) -> bool:
         return False
 
 def generate_random_ast(max_depth=4) -> str:
-    if max_depth <= 1:
-        return f"(number {random.randint(1, 10)})"
-    
-    operators = ['add', 'sub', 'mul', 'div']
-    op = random.choice(operators)
-    
-    left = generate_random_ast(max_depth - 1)
-    right = generate_random_ast(max_depth - 1)
-    
-    # Avoid division by zero by checking the right operand
-    if op == 'div':
-        tokens = tokenize(right)
-        ast = read_from_tokens(tokens)
-        if eval(ast) == 0:
-            right = f"(number {random.randint(1, 10)})"
-            
-    return f"({op} {left} {right})"
+    return generate_expression(max_depth, true_division=True).lisp
 
 def run_tests(num_tests=25):
     depths = range(1, 8)  # K values from 2 to 3
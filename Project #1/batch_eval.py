@@ -0,0 +1,412 @@
+from typing import List, Mapping, NamedTuple, Optional
+import numpy as np
+from expressions import Number, Var, Add, Sub, Mul, Div, Expr
+
+_INT64_MIN = np.iinfo(np.int64).min
+_INT64_MAX = np.iinfo(np.int64).max
+
+# Opcodes for the packed node table
+OP_NUMBER, OP_ADD, OP_SUB, OP_MUL, OP_DIV = range(5)
+
+_OPCODES = {Number: OP_NUMBER, Add: OP_ADD, Sub: OP_SUB, Mul: OP_MUL, Div: OP_DIV}
+_LISP_OPCODES = {'number': OP_NUMBER, 'add': OP_ADD, 'sub': OP_SUB, 'mul': OP_MUL, 'div': OP_DIV}
+
+_IS_SPACE = np.zeros(256, dtype=bool)
+_IS_SPACE[list(b' \t\n\r\x0b\x0c')] = True
+
+class BatchResult(NamedTuple):
+    values: np.ndarray        # int64 value of each tree (meaningless where a mask is set)
+    div_by_zero: np.ndarray   # True where evaluating the tree divides by zero
+    overflow: np.ndarray      # True where an intermediate value left the int64 range
+
+def truncating_divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Element-wise int64 division rounding toward zero; b must not contain zeros."""
+    q = np.floor_divide(a, b)
+    # floor_divide rounds toward -inf, so step back up when the signs differ and there's a remainder
+    q += ((a - q * b) != 0) & ((a < 0) != (b < 0))
+    return q
+
+def _apply_op(op: int, a: np.ndarray, b: np.ndarray, zero: np.ndarray, over: np.ndarray):
+    """
+    Applies one operator element-wise, returning (result, div_by_zero, overflow).
+
+    zero and over are the masks inherited from the operands; they are updated in place.
+    """
+    with np.errstate(over='ignore'):
+        if op == OP_ADD:
+            result = a + b
+            over |= ((a ^ result) & (b ^ result)) < 0
+        elif op == OP_SUB:
+            result = a - b
+            over |= ((a ^ b) & (a ^ result)) < 0
+        elif op == OP_MUL:
+            result = a * b
+            safe_b = np.where(b == 0, 1, b)
+            over |= (b != 0) & ((result // safe_b != a) | ((a == _INT64_MIN) & (b == -1)))
+        else:
+            divisor_zero = b == 0
+            zero |= divisor_zero
+            safe_b = np.where(divisor_zero, 1, b)
+            over |= (a == _INT64_MIN) & (safe_b == -1)
+            result = truncating_divide(a, safe_b)
+    return result, zero, over
+
+class ExprBatch:
+    """
+    Many expression trees packed into structure-of-arrays form.
+
+    Every distinct node gets a row in the opcode, left, right and const columns
+    (children always come before their parents). Nodes are grouped by height and
+    opcode when packing, so evaluate() runs one NumPy ufunc call per
+    (level, operator) pair instead of one Python call per node.
+    """
+
+    def __init__(self, trees: List[Expr]):
+        self.trees = list(trees)
+        self._lisp = None
+        opcode, left, right, const = [], [], [], []
+        too_big = []  # rows whose constant doesn't fit in int64
+        index = {}  # id(node) -> row, so shared subtrees are packed once
+        roots = []
+
+        for tree in self.trees:
+            stack = [(tree, False)]
+            while stack:
+                node, children_done = stack.pop()
+                if id(node) in index:
+                    continue
+                if isinstance(node, Var):
+                    raise TypeError("ExprBatch can't pack Var nodes; use evaluate_columns() instead")
+                if isinstance(node, Number):
+                    row = len(opcode)
+                    opcode.append(OP_NUMBER)
+                    left.append(-1)
+                    right.append(-1)
+                    if _INT64_MIN <= node.value <= _INT64_MAX:
+                        const.append(node.value)
+                    else:
+                        const.append(0)
+                        too_big.append(row)
+                    index[id(node)] = row
+                elif children_done:
+                    row = len(opcode)
+                    opcode.append(_OPCODES[type(node)])
+                    left.append(index[id(node.left)])
+                    right.append(index[id(node.right)])
+                    const.append(0)
+                    index[id(node)] = row
+                else:
+                    stack.append((node, True))
+                    stack.append((node.right, False))
+                    stack.append((node.left, False))
+            roots.append(index[id(tree)])
+
+        self._set_columns(np.array(opcode, dtype=np.int8), np.array(left, dtype=np.int64),
+                          np.array(right, dtype=np.int64), np.array(const, dtype=np.int64),
+                          np.array(roots, dtype=np.int64), np.array(too_big, dtype=np.int64))
+
+    @classmethod
+    def from_lisp(cls, programs: List[str]) -> "ExprBatch":
+        """
+        Packs Lisp texts as the renderers write them (corpus records' lisp
+        field), e.g. (add (number 1) (div (number 7) (number 2))), without
+        building Expr trees.
+
+        The text is scanned as bytes with array operations, matching
+        parentheses by depth and reading literals from runs of digits, so
+        packing costs a few NumPy passes instead of a Python loop over every
+        node. Division truncates as in Expr, whatever lisp_ast's div would do.
+
+        Raises:
+            ValueError: If a program isn't nested (number n) and add/sub/mul/div
+                calls in that layout: each head right after its '(' and
+                followed by whitespace
+        """
+        programs = list(programs)
+        text = ' '.join(programs).encode('ascii')
+        padded = np.frombuffer(text + b' ' * 8, dtype=np.uint8)  # heads can be checked past the end
+        buf = padded[:len(text)]
+        parens = np.flatnonzero((buf == ord('(')) | (buf == ord(')')))
+        is_open = buf[parens] == ord('(')
+        opens, closes = parens[is_open], parens[~is_open]
+        depth = np.cumsum(np.where(is_open, 1, -1).astype(np.int32))
+        if not len(opens) or len(opens) != len(closes) or depth.min() < 0:
+            raise ValueError("Unbalanced parentheses in ExprBatch.from_lisp input")
+
+        # Pair each '(' with its ')': at equal depth they alternate, so stable-sort both by depth
+        if depth.max() < 1 << 15:
+            depth = depth.astype(np.int16)  # sorts by radix
+        open_depth = depth[is_open]
+        close_of = np.empty(len(opens), dtype=np.int64)
+        close_of[np.argsort(open_depth, kind='stable')] = closes[np.argsort(depth[~is_open] + 1, kind='stable')]
+
+        # Node k is the k-th '(' (pre-order); its head starts right after it
+        opcode = np.full(len(opens), -1, dtype=np.int8)
+        for name, code in _LISP_OPCODES.items():
+            word = name.encode('ascii')
+            match = _IS_SPACE[padded[opens + 1 + len(word)]]
+            for j, byte in enumerate(word):
+                match &= padded[opens + 1 + j] == byte
+            opcode[match] = code
+        if (opcode < 0).any():
+            raise ValueError("ExprBatch.from_lisp only reads (number n) and add/sub/mul/div calls")
+        numbers = np.flatnonzero(opcode == OP_NUMBER)
+        operators = np.flatnonzero(opcode != OP_NUMBER)
+
+        # Digits only occur in literals: each run of them is the literal of the next (number n)
+        nested = numbers[numbers + 1 < len(opens)]
+        digits = np.flatnonzero((buf >= ord('0')) & (buf <= ord('9')))
+        run_starts = np.flatnonzero(np.diff(digits, prepend=-2) != 1)
+        starts = digits[run_starts]
+        lengths = np.diff(np.append(run_starts, len(digits)))
+        signed = (buf[starts - 1] == ord('-')) | (buf[starts - 1] == ord('+'))
+        if (len(starts) != len(numbers) or (opens[nested + 1] < close_of[nested]).any()
+                or (starts - signed <= opens[numbers] + len('number') + 1).any()
+                or (starts + lengths > close_of[numbers]).any()):
+            raise ValueError("ExprBatch.from_lisp needs one integer literal in every (number n)")
+
+        # Each digit times its power of ten, summed per literal; up to 18 digits always fit in int64
+        places = np.minimum(np.repeat(starts + lengths, lengths) - 1 - digits, 18)
+        scaled = (buf[digits] - ord('0')).astype(np.int64) * 10 ** places.astype(np.int64)
+        values = np.add.reduceat(scaled, run_starts) if len(digits) else np.zeros(0, dtype=np.int64)
+        const = np.zeros(len(opens), dtype=np.int64)
+        const[numbers] = np.where(buf[starts - 1] == ord('-'), -values, values)
+        too_big = []
+        for i in np.flatnonzero(lengths > 18).tolist():
+            literal = int(text[starts[i] - signed[i]:starts[i] + lengths[i]])
+            if _INT64_MIN <= literal <= _INT64_MAX:
+                const[numbers[i]] = literal
+            else:
+                const[numbers[i]] = 0
+                too_big.append(numbers[i])
+        too_big = np.array(too_big, dtype=np.int64)
+
+        # The left operand is the next node; the right one is the first node after the left one closes
+        left = np.full(len(opens), -1, dtype=np.int64)
+        right = np.full(len(opens), -1, dtype=np.int64)
+        if len(operators):
+            if operators[-1] + 1 >= len(opens) or (opens[operators + 1] > close_of[operators]).any():
+                raise ValueError("ExprBatch.from_lisp needs two operands per call")
+            left[operators] = operators + 1
+            right[operators] = np.searchsorted(opens, close_of[operators + 1])
+            if (right[operators] >= len(opens)).any():
+                raise ValueError("ExprBatch.from_lisp needs two operands per call")
+            # The right operand's ')' must be the last one before the call's own
+            if (np.searchsorted(closes, close_of[right[operators]], side='right')
+                    != np.searchsorted(closes, close_of[operators])).any():
+                raise ValueError("ExprBatch.from_lisp needs exactly two operands per call")
+
+        # Every other non-space byte belongs to a parenthesis, a head or a literal, so no stray tokens slipped in
+        expected = (2 * len(opens) + 3 * len(operators) + len('number') * len(numbers)
+                    + int(lengths.sum()) + int(signed.sum()))
+        if len(buf) - np.count_nonzero(_IS_SPACE[buf]) != expected:
+            raise ValueError("ExprBatch.from_lisp found tokens outside number/add/sub/mul/div calls")
+
+        # Programs are joined by one space; each must hold exactly one whole root, so none ends or starts mid-tree
+        starts_at = np.cumsum([0] + [len(program) + 1 for program in programs[:-1]])
+        roots = np.flatnonzero(open_depth == 1)
+        if (len(roots) != len(programs)
+                or (np.searchsorted(starts_at, opens[roots], side='right') - 1 != np.arange(len(programs))).any()
+                or (np.searchsorted(starts_at, close_of[roots], side='right') - 1 != np.arange(len(programs))).any()):
+            raise ValueError("ExprBatch.from_lisp needs exactly one expression per program")
+
+        batch = cls.__new__(cls)
+        batch.trees = None
+        batch._lisp = programs
+        # Operands are one deeper than their call, so deepest-first is a valid evaluation order
+        batch._set_columns(opcode, left, right, const, roots, too_big,
+                           level=int(open_depth.max()) - open_depth.astype(np.int64))
+        return batch
+
+    def _set_columns(self, opcode, left, right, const, roots, too_big, level=None):
+        """Stores the columns and groups the operator rows; level defaults to each node's height."""
+        self.opcode, self.left, self.right, self.const = opcode, left, right, const
+        self.roots = roots
+        self._too_big = too_big
+
+        rows = np.flatnonzero(opcode != OP_NUMBER)
+        if level is None:
+            # Relax every operator row together until no height changes
+            level = np.zeros(len(opcode), dtype=np.int64)
+            while len(rows):
+                heights = np.maximum(level[left[rows]], level[right[rows]]) + 1
+                if np.array_equal(heights, level[rows]):
+                    break
+                level[rows] = heights
+        self.level = level
+
+        # Operator rows sorted by (level, opcode), split into one group per pair
+        keys = level[rows] * 8 + opcode[rows]
+        order = np.argsort(keys.astype(np.int16) if len(keys) and keys.max() < 1 << 15 else keys, kind='stable')
+        rows, keys = rows[order], keys[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        self._groups = [(int(self.opcode[group[0]]), group) for group in np.split(rows, bounds) if len(group)]
+
+    def __len__(self) -> int:
+        return len(self.roots)
+
+    def evaluate(self) -> BatchResult:
+        """Evaluates every tree at once with int64 arithmetic and truncating division."""
+        values = self.const.copy()
+        div_by_zero = np.zeros(len(values), dtype=bool)
+        overflow = np.zeros(len(values), dtype=bool)
+        overflow[self._too_big] = True
+
+        for op, rows in self._groups:
+            left, right = self.left[rows], self.right[rows]
+            result, zero, over = _apply_op(op, values[left], values[right],
+                                           div_by_zero[left] | div_by_zero[right],
+                                           overflow[left] | overflow[right])
+            values[rows] = result
+            div_by_zero[rows] = zero
+            overflow[rows] = over
+
+        return BatchResult(values[self.roots], div_by_zero[self.roots], overflow[self.roots])
+
+    def results(self) -> List[Optional[int]]:
+        """
+        Per-tree Python values matching Expr.eval(), or None on division by zero.
+
+        Trees that overflowed int64 are re-evaluated exactly with Expr.eval().
+        """
+        batch = self.evaluate()
+        out = []
+        for i, (value, zero, over) in enumerate(zip(batch.values.tolist(), batch.div_by_zero.tolist(),
+                                                    batch.overflow.tolist())):
+            if over:
+                try:
+                    out.append(self._tree(i).eval())
+                except ZeroDivisionError:
+                    out.append(None)
+            elif zero:
+                out.append(None)
+            else:
+                out.append(value)
+        return out
+
+    def _tree(self, i: int) -> Expr:
+        if self.trees is not None:
+            return self.trees[i]
+        from ir import lisp_to_expr  # only needed for the rare tree that overflows
+        return lisp_to_expr(self._lisp[i])
+
+def evaluate_batch(trees: List[Expr]) -> BatchResult:
+    """
+    Packs trees into an ExprBatch and evaluates them all at once.
+
+    Packing visits every node in Python, which costs more than evaluating them
+    with eval(); trees stored as Lisp text (a corpus) pack much faster with
+    ExprBatch.from_lisp().
+    """
+    return ExprBatch(trees).evaluate()
+
+def evaluate_columns(expr: Expr, bindings: Mapping[str, np.ndarray]) -> np.ma.MaskedArray:
+    """
+    Evaluates one expression over whole columns of variable bindings.
+
+    Each distinct node is visited once and computed for every row at a time, so
+    checking a formula on a million inputs costs a handful of ufunc calls per node.
+
+    Args:
+        expr (Expr): The expression to evaluate
+        bindings (Mapping[str, np.ndarray]): Equal-length integer arrays for each Var name
+
+    Returns:
+        np.ma.MaskedArray: int64 results, masked where the row divides by zero
+            or an intermediate value overflows int64
+    """
+    columns = {name: np.asarray(column, dtype=np.int64) for name, column in bindings.items()}
+    lengths = {len(column) for column in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError("All binding columns must have the same length")
+    n = lengths.pop() if lengths else 1
+
+    results = {}  # id(node) -> (values, div_by_zero, overflow)
+    stack = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if id(node) in results:
+            continue
+        if isinstance(node, Number):
+            fits = _INT64_MIN <= node.value <= _INT64_MAX
+            results[id(node)] = (np.full(n, node.value if fits else 0, dtype=np.int64),
+                                 np.zeros(n, dtype=bool), np.full(n, not fits))
+        elif isinstance(node, Var):
+            if node.name not in columns:
+                raise NameError(f"Unbound variable: {node.name}")
+            results[id(node)] = (columns[node.name], np.zeros(n, dtype=bool), np.zeros(n, dtype=bool))
+        elif children_done:
+            a, a_zero, a_over = results[id(node.left)]
+            b, b_zero, b_over = results[id(node.right)]
+            results[id(node)] = _apply_op(_OPCODES[type(node)], a, b, a_zero | b_zero, a_over | b_over)
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+
+    values, div_by_zero, overflow = results[id(expr)]
+    return np.ma.masked_array(values, mask=div_by_zero | overflow)
+
+def test_from_lisp():
+    """Test ExprBatch.from_lisp against Expr.eval() and on malformed input"""
+    import random
+    from generators import generate_expression
+    from ir import lisp_to_expr
+
+    generated = [generate_expression(depth, random.Random(i)) for i, depth in enumerate([1, 2, 5, 8] * 25)]
+    big = ["(add (number 9223372036854775807) (number 1))", "(mul (number -100000000000000000000) (number 0))",
+           "(div (number 1) (sub (number 2) (number 2)))", "(sub   (number +3)\n(number -4) )"]
+    valid = [g.lisp for g in generated] + big
+    expected = [g.value for g in generated] + [2 ** 63, 0, None, 7]
+
+    malformed = [
+        ["(add (number 1) (number 2)"],                    # unbalanced parentheses
+        ["(add (number 1) (number 2)))"],
+        [")(number 1)("],
+        ["(add (number 1) (number 2)", ") (number 3)"],    # one tree split across two programs
+        ["(number 1) (number 2)", ""],                     # two trees in one program
+        ["(number 1)", "(number 2) (number 3)"],
+        ["(pow (number 1) (number 2))"],                   # bad heads
+        ["(addd (number 1) (number 2))"],
+        ["(add(number 1) (number 2))"],
+        ["((number 1) (number 2))"],
+        ["(add (number 1))"],                              # wrong operand counts
+        ["(add (number 1) (number 2) (number 3))"],
+        ["(number 1 2)"],                                  # bad literals
+        ["(number x)"],
+        ["(number (number 1))"],
+        ["(add (number 1) x (number 2))"],                 # stray tokens
+        ["(number 1) x"],
+        [""],
+    ]
+
+    passed = 0
+    failed = 0
+
+    results = ExprBatch.from_lisp(valid).results()
+    reference = [lisp_to_expr(program) for program in valid]
+    if results == expected and results[:len(generated)] == ExprBatch(reference[:len(generated)]).results():
+        print(f"PASS: {len(valid)} programs evaluate as Expr.eval() does")
+        passed += 1
+    else:
+        mismatches = [(program, got, want) for program, got, want in zip(valid, results, expected) if got != want]
+        print(f"FAIL: from_lisp disagrees with Expr.eval(), e.g. {mismatches[:3]}")
+        failed += 1
+
+    for programs in malformed:
+        try:
+            ExprBatch.from_lisp(programs)
+        except ValueError as e:
+            print(f"PASS: {programs!r} → {e}")
+            passed += 1
+        else:
+            print(f"FAIL: {programs!r} was accepted")
+            failed += 1
+
+    print(f"\nTest Summary:")
+    print(f"Passed: {passed}")
+    print(f"Failed: {failed}")
+    print(f"Total: {passed + failed}")
+
+if __name__ == "__main__":
+    test_from_lisp()
@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+from response_cache import CachedResponse, ResponseCache, request_key
+
+CHAT_COMPLETIONS = "/v1/chat/completions"
+FINISHED = ('completed', 'failed', 'expired', 'cancelled')
+
+class BatchRequest(NamedTuple):
+    custom_id: str          # unique within the batch; results are joined back on it
+    model: str
+    system_message: str
+    user_message: str
+
+    def body(self, temperature: float = 0.0) -> dict:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_message},
+                {"role": "user", "content": self.user_message}
+            ],
+            "temperature": temperature,
+        }
+
+class BatchRequestError(Exception):
+    """Stands in for the response of a request the batch couldn't complete."""
+
+def write_batch_file(path: str, requests: Iterable[BatchRequest], temperature: float = 0.0) -> int:
+    """Writes requests as a batch input JSONL file and returns how many were written."""
+    count = 0
+    with open(path, 'w') as f:
+        for request in requests:
+            f.write(json.dumps({"custom_id": request.custom_id, "method": "POST", "url": CHAT_COMPLETIONS,
+                                "body": request.body(temperature)}) + '\n')
+            count += 1
+    return count
+
+def _result(line: dict):
+    """A batch output line as a CachedResponse, or a BatchRequestError."""
+    response = line.get("response")
+    if line.get("error") or response is None or response.get("status_code") != 200:
+        error = line.get("error") or (response or {}).get("body", {}).get("error") or response
+        return BatchRequestError(f"{line['custom_id']}: {error}")
+    body = response["body"]
+    usage = body.get("usage") or {}
+    return CachedResponse(body["choices"][0]["message"]["content"], usage.get("prompt_tokens", 0),
+                          usage.get("completion_tokens", 0), body.get("model", ""), cached=False)
+
+class OpenAIBatchBackend:
+    """Runs batch files through the OpenAI Batch API (uploaded files, 24h completion window)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, path: str) -> str:
+        with open(path, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=CHAT_COMPLETIONS,
+                                           completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def output_lines(self, batch_id: str) -> Iterator[dict]:
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in self.client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        yield json.loads(line)
+
+class LocalBatchBackend:
+    """
+    Runs batch files in a background thread against any chat completions client,
+    e.g. a cached client or a local fake, writing output in the Batch API's format.
+
+    Requests go through a thread pool of the given size, so a 100k-request file
+    only needs the one call per request and no connection is held open between
+    submitting and collecting.
+    """
+
+    def __init__(self, client, workers: int = 8):
+        self.client = client
+        self.workers = workers
+        self._threads = {}
+
+    def _complete(self, line: dict) -> dict:
+        try:
+            response = self.client.chat.completions.create(**line["body"])
+        except Exception as e:
+            return {"custom_id": line["custom_id"], "response": None, "error": {"message": str(e)}}
+        usage = response.usage
+        return {"custom_id": line["custom_id"], "error": None, "response": {"status_code": 200, "body": {
+            "model": getattr(response, "model", line["body"]["model"]),
+            "choices": [{"index": 0, "message": {"role": "assistant",
+                                                 "content": response.choices[0].message.content}}],
+            "usage": {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens},
+        }}}
+
+    def _run(self, path: str, output_path: str):
+        with open(path) as f, ThreadPoolExecutor(self.workers) as pool, open(output_path + '.tmp', 'w') as out:
+            lines = (json.loads(line) for line in f if line.strip())
+            for result in pool.map(self._complete, lines):
+                out.write(json.dumps(result) + '\n')
+        os.replace(output_path + '.tmp', output_path)
+
+    def submit(self, path: str) -> str:
+        batch_id = path + '.output.jsonl'
+        thread = threading.Thread(target=self._run, args=(path, batch_id), daemon=True)
+        self._threads[batch_id] = thread
+        thread.start()
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        thread = self._threads.get(batch_id)
+        if thread is not None and thread.is_alive():
+            return 'in_progress'
+        return 'completed' if os.path.exists(batch_id) else 'failed'
+
+    def output_lines(self, batch_id: str) -> Iterator[dict]:
+        with open(batch_id) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def run_batch(requests: Iterable[BatchRequest], backend, path: str, temperature: float = 0.0,
+              cache: Optional[ResponseCache] = None, poll_interval: float = 30.0,
+              timeout: Optional[float] = None) -> Dict[str, object]:
+    """
+    Sends requests as one batch and waits for the results.
+
+    Requests already in cache are answered from it and left out of the batch
+    file; new results are added to it.
+
+    Args:
+        requests: The requests, with unique custom_ids
+        backend: OpenAIBatchBackend, LocalBatchBackend or anything with
+            submit(path) -> id, status(id) and output_lines(id)
+        path (str): Where to write the batch input file
+        cache (ResponseCache, optional): Response cache to read and fill
+        poll_interval (float): Seconds between status checks
+        timeout (float, optional): Give up waiting after this many seconds
+
+    Returns:
+        dict: custom_id -> response (with choices and usage like a chat
+            completion), or a BatchRequestError for a request that failed
+    """
+    results = {}
+    pending = {}
+    for request in requests:
+        if request.custom_id in results or request.custom_id in pending:
+            raise ValueError(f"duplicate custom_id {request.custom_id!r}")
+        cached = None
+        if cache is not None:
+            cached = cache.get(request_key(request.model, request.body(temperature)["messages"],
+                                           temperature=temperature))
+        if cached is not None:
+            results[request.custom_id] = cached
+        else:
+            pending[request.custom_id] = request
+    if not pending:
+        return results
+
+    write_batch_file(path, pending.values(), temperature)
+    batch_id = backend.submit(path)
+    started = time.monotonic()
+    while True:
+        status = backend.status(batch_id)
+        if status in FINISHED:
+            break
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"batch {batch_id} still {status} after {timeout}s")
+        time.sleep(poll_interval)
+
+    for line in backend.output_lines(batch_id):
+        request = pending.get(line.get("custom_id"))
+        if request is None:
+            continue
+        result = _result(line)
+        results[request.custom_id] = result
+        if cache is not None and not isinstance(result, BatchRequestError):
+            cache.put(request_key(request.model, request.body(temperature)["messages"],
+                                  temperature=temperature), result)
+    for custom_id in pending:
+        results.setdefault(custom_id, BatchRequestError(f"{custom_id}: no result (batch {status})"))
+    return results
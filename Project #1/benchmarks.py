@@ -0,0 +1,169 @@
+import random
+import time
+from expressions import Number, Add, Sub, Mul, Div, Expr
+import lisp_ast
+
+def random_expr(max_depth: int, rng: random.Random) -> Expr:
+    """Builds a complete random expression tree without touching the API clients."""
+    if max_depth <= 1:
+        return Number(rng.randint(1, 10))
+    op = rng.choice([Add, Sub, Mul, Div])
+    return op(random_expr(max_depth - 1, rng), random_expr(max_depth - 1, rng))
+
+def random_lisp_program(max_depth: int, rng: random.Random, variables=()) -> list:
+    """
+    A complete random parsed Lisp program over float constants, so it practically never divides by zero.
+
+    Given variables, about half the leaves are one of those symbols instead;
+    (sub x x) can then make a divisor zero.
+    """
+    if max_depth <= 1:
+        if variables and rng.random() < 0.5:
+            return rng.choice(variables)
+        return ['number', rng.uniform(1, 10)]
+    return [rng.choice(['add', 'sub', 'mul', 'div']),
+            random_lisp_program(max_depth - 1, rng, variables),
+            random_lisp_program(max_depth - 1, rng, variables)]
+
+def _time(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def _outcome(fn):
+    """fn()'s value, or ZeroDivisionError if it divides by zero."""
+    try:
+        return fn()
+    except ZeroDivisionError:
+        return ZeroDivisionError
+
+def _eval_all(fns):
+    for fn in fns:
+        try:
+            fn()
+        except ZeroDivisionError:
+            pass
+
+def benchmark_compile(depth: int = 10, num_trees: int = 200, repeats: int = 5, seed: int = 0):
+    """
+    Compares tree-walking Expr.eval() against calling Expr.compile() functions.
+
+    eval() caches values on the nodes, so each repeat walks a freshly built copy
+    of the corpus; the compiled functions are built once and called every repeat.
+    """
+    trees = [random_expr(depth, random.Random(seed + i)) for i in range(num_trees)]
+
+    start = time.perf_counter()
+    compiled = [tree.compile() for tree in trees]
+    compile_time = time.perf_counter() - start
+
+    eval_time = 0.0
+    call_time = 0.0
+    for _ in range(repeats):
+        fresh = [random_expr(depth, random.Random(seed + i)) for i in range(num_trees)]
+        eval_time += _time(lambda: _eval_all([tree.eval for tree in fresh]))
+        call_time += _time(lambda: _eval_all(compiled))
+
+    print(f"Compile benchmark: {num_trees} trees of depth {depth}, {repeats} repeats")
+    print(f"One-time compile: {compile_time:.4f}s")
+    print(f"Expr.eval():      {eval_time:.4f}s")
+    print(f"Compiled calls:   {call_time:.4f}s ({eval_time / call_time:.1f}x faster)")
+
+def benchmark_batch(depths=range(1, 13), num_trees: int = 2000, seed: int = 0):
+    """
+    Compares per-tree Expr.eval() with evaluating all trees of a depth as one batch.
+
+    Both batch timings include packing: evaluate_batch(trees) packs Expr trees
+    with a Python loop per node, and ExprBatch.from_lisp() packs the Lisp text
+    a corpus stores with array operations. Trees come from
+    generate_expression(), so none divides by zero and every eval() runs to
+    the end; each is parsed fresh from its code so no values are cached.
+    """
+    from batch_eval import ExprBatch, evaluate_batch
+    from code_parser import parse_code
+    from generators import generate_expression
+
+    print(f"Batch benchmark: {num_trees} trees per depth, packing included")
+    for depth in depths:
+        generated = [generate_expression(depth, random.Random(seed + i)) for i in range(num_trees)]
+        programs = [g.lisp for g in generated]
+        trees = [parse_code(g.code) for g in generated]
+        pack_time = _time(lambda: evaluate_batch(trees))
+        lisp_time = _time(lambda: ExprBatch.from_lisp(programs).evaluate())
+        eval_time = _time(lambda: _eval_all([tree.eval for tree in trees]))
+        print(f"depth {depth:2d}: eval() {eval_time:.4f}s, evaluate_batch {pack_time:.4f}s "
+              f"({eval_time / pack_time:.1f}x), from_lisp {lisp_time:.4f}s ({eval_time / lisp_time:.1f}x)")
+
+def benchmark_lisp_analyze(depth: int = 8, num_programs: int = 200, repeats: int = 5, seed: int = 0,
+                           num_variables: int = 8):
+    """
+    Compares lisp_ast.eval() on parsed programs with calling their analyzed closures.
+
+    Half the leaves are free variables that are only defined after analysis, so
+    the closures look them up and do the arithmetic on every call; each repeat
+    defines new values, and both sides must agree on every result. The one-time
+    analysis cost is reported separately, and so are programs of constants
+    only, which analysis folds to a single value.
+    """
+    variables = [f"x{i}" for i in range(num_variables)]
+    programs = [random_lisp_program(depth, random.Random(seed + i), variables) for i in range(num_programs)]
+    constant_programs = [random_lisp_program(depth, random.Random(seed + i)) for i in range(num_programs)]
+    env = lisp_ast.standard_env()
+
+    start = time.perf_counter()
+    procs = [lisp_ast.analyze(x, env) for x in programs]
+    analyze_time = time.perf_counter() - start
+    folded = [lisp_ast.analyze(x, env) for x in constant_programs]
+
+    rng = random.Random(seed)
+    eval_time = 0.0
+    call_time = 0.0
+    folded_eval_time = 0.0
+    folded_call_time = 0.0
+    for _ in range(repeats):
+        for name in variables:
+            lisp_ast.eval(['define', name, ['number', rng.uniform(1, 10)]], env)
+        eval_time += _time(lambda: _eval_all([lambda x=x: lisp_ast.eval(x, env) for x in programs]))
+        call_time += _time(lambda: _eval_all(procs))
+        if ([_outcome(lambda x=x: lisp_ast.eval(x, env)) for x in programs]
+                != [_outcome(proc) for proc in procs]):
+            raise AssertionError("analyzed closures disagree with lisp_ast.eval()")
+        folded_eval_time += _time(lambda: _eval_all([lambda x=x: lisp_ast.eval(x, env) for x in constant_programs]))
+        folded_call_time += _time(lambda: _eval_all(folded))
+
+    print(f"Lisp analyze benchmark: {num_programs} programs of depth {depth} over {num_variables} "
+          f"variables, {repeats} repeats")
+    print(f"One-time analysis: {analyze_time:.4f}s")
+    print(f"lisp_ast.eval():   {eval_time:.4f}s")
+    print(f"Analyzed closures: {call_time:.4f}s ({eval_time / call_time:.1f}x faster)")
+    print(f"Constants only:    eval() {folded_eval_time:.4f}s, folded closures {folded_call_time:.4f}s "
+          f"({folded_eval_time / folded_call_time:.1f}x faster)")
+
+def benchmark_lisp_vm(depths=range(1, 21), nodes_per_depth: int = 1 << 16, seed: int = 0):
+    """
+    Compares lisp_ast.eval() with the bytecode VM on parsed programs of each depth.
+
+    Each depth gets about the same number of nodes in total, so shallow corpora
+    hold many small programs and deep ones a few large ones. Compiling is timed
+    separately from running the bytecode. Constants are floats so deep
+    programs run to completion instead of stopping at a division by zero.
+    """
+    import lisp_vm
+
+    print(f"Lisp VM benchmark: ~{nodes_per_depth} nodes per depth")
+    for depth in depths:
+        num_programs = max(1, nodes_per_depth >> depth)
+        programs = [random_lisp_program(depth, random.Random(seed + i)) for i in range(num_programs)]
+        start = time.perf_counter()
+        compiled = [lisp_vm.compile_bytecode(x) for x in programs]
+        compile_time = time.perf_counter() - start
+        eval_time = _time(lambda: _eval_all([lambda x=x: lisp_ast.eval(x) for x in programs]))
+        run_time = _time(lambda: _eval_all([lambda b=b: lisp_vm.run(b) for b in compiled]))
+        print(f"depth {depth:2d} ({num_programs:5d} programs): eval() {eval_time:.4f}s, "
+              f"compile {compile_time:.4f}s, VM {run_time:.4f}s ({eval_time / run_time:.1f}x)")
+
+if __name__ == "__main__":
+    benchmark_compile()
+    benchmark_batch()
+    benchmark_lisp_analyze()
+    benchmark_lisp_vm()
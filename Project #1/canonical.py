@@ -0,0 +1,109 @@
+import hashlib
+from typing import Callable, Iterable, List, Optional
+from expressions import Number, Var, Expr
+import lisp_ast
+
+# Operators whose operands can be reordered and regrouped freely
+COMMUTATIVE = frozenset(('add', 'mul'))
+
+_DIGEST_SIZE = 16
+
+def _parts(x):
+    """(label, children) for an Expr node or a parsed Lisp expression; children is () for a leaf."""
+    if isinstance(x, Expr):
+        if isinstance(x, Number):
+            return ('num', x.value), ()
+        if isinstance(x, Var):
+            return ('var', x.name), ()
+        return x.lisp_name, (x.left, x.right)
+    if isinstance(x, (int, float)):
+        return ('num', x), ()
+    if isinstance(x, str):
+        return ('var', x), ()
+    if len(x) == 2 and x[0] == 'number' and isinstance(x[1], (int, float)):
+        return ('num', x[1]), ()
+    if x and isinstance(x[0], str):
+        return x[0], tuple(x[1:])
+    return '()', tuple(x)
+
+def _operands(x, label) -> list:
+    """The operands of the whole chain of label-operators rooted at x, e.g. a, b, c for (a + b) + c."""
+    operands = []
+    stack = [x]
+    while stack:
+        node = stack.pop()
+        node_label, children = _parts(node)
+        if node is not x and node_label != label:
+            operands.append(node)
+        else:
+            stack.extend(reversed(children))
+    return operands
+
+def _leaf_digest(label) -> bytes:
+    kind, value = label
+    return hashlib.blake2b(f"{kind}:{value!r}".encode(), digest_size=_DIGEST_SIZE).digest()
+
+def _node_digest(label: str, operands: List[bytes]) -> bytes:
+    h = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+    h.update(f"{label}/{len(operands)}:".encode())
+    for digest in operands:
+        h.update(digest)
+    return h.digest()
+
+def canonical_digest(tree) -> bytes:
+    """
+    A stable digest of tree's canonical form.
+
+    Chains of add or mul are flattened into one n-ary node and their operands
+    sorted, so trees that differ only in the order or grouping of added or
+    multiplied operands get the same digest; sub, div and any other form
+    keep their operand order. Works on Expr trees, parsed lisp_ast lists and
+    Lisp source text, and (number 5), 5 and Number(5) are the same leaf.
+    Iterative and O(n log n); the digest is the same in every process.
+    """
+    if isinstance(tree, str):
+        tree = lisp_ast.parse(tree)
+    digests = []
+    stack = [(tree, None)]
+    while stack:
+        node, operand_count = stack.pop()
+        label, children = _parts(node)
+        if operand_count is not None:
+            operands = digests[len(digests) - operand_count:]
+            del digests[len(digests) - operand_count:]
+            if label in COMMUTATIVE:
+                operands.sort()
+            digests.append(_node_digest(label, operands))
+        elif not children:
+            digests.append(_leaf_digest(label))
+        else:
+            operands = _operands(node, label) if label in COMMUTATIVE else children
+            stack.append((node, len(operands)))
+            stack.extend((operand, None) for operand in reversed(operands))
+    return digests[0]
+
+def canonical_hash(tree) -> str:
+    """canonical_digest as a hex string."""
+    return canonical_digest(tree).hex()
+
+def equivalent(a, b) -> bool:
+    """Whether a and b are the same expression up to reordering and regrouping add and mul operands."""
+    return canonical_digest(a) == canonical_digest(b)
+
+def dedupe(trees: Iterable, key: Optional[Callable] = None) -> list:
+    """
+    The trees with canonical duplicates removed, keeping the first of each in order.
+
+    Args:
+        trees: Expr trees, parsed Lisp or Lisp text (or anything key maps to one)
+        key (callable, optional): Extracts the tree from each item, e.g.
+            lambda case: case.tree for GeneratedExpression items
+    """
+    seen = set()
+    unique = []
+    for item in trees:
+        digest = canonical_digest(item if key is None else key(item))
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(item)
+    return unique
@@ -0,0 +1,186 @@
+import re
+from typing import Tuple
+from expressions import Number, Var, Add, Sub, Mul, Div, Expr
+
+# One token per match, starting at a non-space character; whitespace is skipped
+# by a separate _TRAILING_SPACE match first, so a long run of it followed by a
+# bad character is scanned once instead of once per starting offset
+_TOKEN = re.compile(r"""(?:
+    (?P<int>[+-]?\d+)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<str>'[^'\\\n]*'|"[^"\\\n]*")
+  | (?P<punct>[(),])
+)""", re.VERBOSE)
+_TRAILING_SPACE = re.compile(r'\s*')
+_FENCE = re.compile(r'```[^\n`]*\n(.*?)```', re.DOTALL)
+
+_OPERATORS = {'Add': Add, 'Sub': Sub, 'Mul': Mul, 'Div': Div}
+
+# Longer literals are rejected before int() sees them: int() is quadratic in the
+# digit count and refuses more than sys.get_int_max_str_digits() with a bare ValueError
+MAX_LITERAL_DIGITS = 100
+
+class CodeParseError(SyntaxError):
+    """
+    Raised for text that isn't a valid Number/Var/Add/Sub/Mul/Div expression.
+
+    lineno and offset (1-based, as for any SyntaxError) point at the offending
+    character; position is the same place as a 0-based index into the text.
+    """
+
+    def __init__(self, msg: str, text: str, position: int):
+        lineno = text.count('\n', 0, position) + 1
+        line_start = text.rfind('\n', 0, position) + 1
+        line_end = text.find('\n', position)
+        line = text[line_start:line_end if line_end != -1 else len(text)]
+        super().__init__(msg, ('<code>', lineno, position - line_start + 1, line))
+        self.position = position
+
+def _strip_markdown(text: str) -> Tuple[int, int]:
+    """The span of text left after removing a markdown code fence, backticks and a trailing ';'."""
+    start, end = 0, len(text)
+    fence = _FENCE.search(text)
+    if fence:
+        start, end = fence.span(1)
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and (text[end - 1].isspace() or text[end - 1] == ';'):
+        end -= 1
+    if end - start >= 2 and text[start] == text[end - 1] == '`':
+        start += 1
+        end -= 1
+    return start, end
+
+def parse_code(text: str, lenient: bool = False) -> Expr:
+    """
+    Parses the Add(Number(1), Mul(...)) code format into an Expr tree.
+
+    This is a small hand-written scanner and parser for exactly the
+    Number/Var/Add/Sub/Mul/Div call syntax, so it never executes anything
+    and always finishes in time linear in the input. It keeps its own stack
+    instead of recursing, so any nesting depth works.
+
+    Args:
+        text (str): The code to parse, e.g. a model response
+        lenient (bool): First strip a markdown code fence, surrounding
+            backticks and a trailing semicolon
+
+    Returns:
+        Expr: The parsed expression
+
+    Raises:
+        CodeParseError: If the text isn't a single valid expression; the
+            error's position/lineno/offset point at the problem
+    """
+    pos, end = _strip_markdown(text) if lenient else (0, len(text))
+
+    def next_token():
+        nonlocal pos
+        pos = _TRAILING_SPACE.match(text, pos, end).end()
+        match = _TOKEN.match(text, pos, end)
+        if match is None:
+            if pos == end:
+                raise CodeParseError("unexpected end of input", text, end)
+            raise CodeParseError(f"unexpected character {text[pos]!r}", text, pos)
+        pos = match.end()
+        return match.lastgroup, match.group(match.lastgroup), match.start(match.lastgroup)
+
+    def expect(punct: str):
+        kind, value, at = next_token()
+        if kind != 'punct' or value != punct:
+            raise CodeParseError(f"expected {punct!r}, got {value!r}", text, at)
+
+    pending = []  # [operator class, operands so far] for calls whose arguments are still being read
+    while True:
+        # Read one operand: a leaf, or the opening of another operator call
+        kind, value, at = next_token()
+        if kind != 'name':
+            raise CodeParseError(f"expected Number, Var, Add, Sub, Mul or Div, got {value!r}", text, at)
+        expect('(')
+        if value == 'Number':
+            kind, literal, at = next_token()
+            if kind != 'int':
+                raise CodeParseError(f"Number needs an integer literal, got {literal!r}", text, at)
+            if len(literal.lstrip('+-')) > MAX_LITERAL_DIGITS:
+                raise CodeParseError(f"integer literal longer than {MAX_LITERAL_DIGITS} digits", text, at)
+            expect(')')
+            node = Number(int(literal))
+        elif value == 'Var':
+            kind, literal, at = next_token()
+            if kind != 'str':
+                raise CodeParseError(f"Var needs a quoted name, got {literal!r}", text, at)
+            expect(')')
+            try:
+                node = Var(literal[1:-1])
+            except TypeError as e:
+                raise CodeParseError(str(e), text, at) from None
+        elif value in _OPERATORS:
+            pending.append([_OPERATORS[value], []])
+            continue
+        else:
+            raise CodeParseError(f"unknown constructor {value!r}", text, at)
+
+        # Hand the finished operand to the calls waiting on it, closing any that are complete
+        while pending:
+            op, operands = pending[-1]
+            operands.append(node)
+            if len(operands) == 1:
+                expect(',')
+                break
+            kind, value, at = next_token()
+            if kind == 'punct' and value == ',':  # a trailing comma is valid Python
+                kind, value, at = next_token()
+            if kind != 'punct' or value != ')':
+                raise CodeParseError(f"{op.__name__} takes exactly two arguments", text, at)
+            pending.pop()
+            node = op(*operands)
+        if not pending:
+            break
+
+    trailing = _TRAILING_SPACE.match(text, pos, end).end()
+    if trailing != end:
+        raise CodeParseError("unexpected text after the expression", text, trailing)
+    return node
+
+def test_parse_code():
+    """Test the code parser on valid input, bad input and input built to make a regex backtrack"""
+    import time
+    test_cases = [
+        ("Add(Number(2), Mul(Number(3), Number(-4)))", "2 + 3 * -4"),
+        ("  Sub( Number(5) ,Number(+1), )  ", "5 - 1"),
+        ("Div(Var('x'), Number(7))", "x / 7"),
+        ("Add(Number(1), Number(2)) #", CodeParseError),
+        ("Add(Number(1)," + " " * 40_000 + "#", CodeParseError),
+        (" " * 40_000 + "#", CodeParseError),
+        ("Number(" + " " * 40_000 + "-#)", CodeParseError),
+        ("Number(-" + "9" * 100 + ")", str(-int("9" * 100))),
+        ("Number(" + "1" * 5_000 + ")", CodeParseError),
+        ("Add(Number(1), Number(" + "7" * 1_000_000 + "))", CodeParseError),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for code, expected in test_cases:
+        label = code if len(code) < 60 else f"{code[:30]!r}...({len(code)} chars)"
+        start = time.perf_counter()
+        try:
+            result = str(parse_code(code))
+        except CodeParseError as e:
+            result = CodeParseError
+            error = e
+        elapsed = time.perf_counter() - start
+        if result == expected and elapsed < 0.5:
+            print(f"PASS: {label} → {error.msg if result is CodeParseError else result}")
+            passed += 1
+        else:
+            print(f"FAIL: {label}, expected {expected}, got {result} in {elapsed:.2f}s")
+            failed += 1
+
+    print(f"\nTest Summary:")
+    print(f"Passed: {passed}")
+    print(f"Failed: {failed}")
+    print(f"Total: {passed + failed}")
+
+if __name__ == "__main__":
+    test_parse_code()
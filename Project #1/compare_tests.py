@@ -1,11 +1,18 @@
 import matplotlib.pyplot as plt
+import asyncio
 from lisp_tests import test_gpt_expression_conversion as test_lisp
+from lisp_tests import test_gpt_expression_conversion_async as test_lisp_async
 from expression_tests import test_gpt_expression_conversion as test_expr
+from expression_tests import test_gpt_expression_conversion_async as test_expr_async
+from corpus import open_corpus
 
-def run_comparison_tests(num_tests=25):
+def run_comparison_tests(num_tests=25, corpus_dir="corpus", concurrency=None):
+    """Sweeps depths 1-6 for both formats; with concurrency set, each test sends that many requests at once."""
     print("\nRunning comparison tests across depths 1-6:")
     
     depths = range(1, 7)
+    # Both formats are tested on the same distinct trees, read from (or first written to) the corpus
+    corpus = open_corpus(corpus_dir, depths, num_tests, dedupe=True)
     lisp_value_rates = []
     lisp_code_rates = []
     expr_value_rates = []
@@ -18,14 +25,31 @@ def run_comparison_tests(num_tests=25):
     for depth in depths:
         print(f"\nTesting depth {depth}:")
         
+        lisp_cases = corpus.cases(depth, num_tests, true_division=True)
+        expr_cases = corpus.cases(depth, num_tests)  # fewer than num_tests where a depth has few distinct trees
+        
         print("Testing Lisp expressions...")
-        lisp_value, lisp_code, lisp_tokens, lisp_eval = test_lisp(num_tests, depth)
+        if concurrency:
+            lisp_value, lisp_code, lisp_tokens, lisp_eval = asyncio.run(test_lisp_async(
+                len(lisp_cases), depth, cases=lisp_cases, concurrency=concurrency
+            ))
+        else:
+            lisp_value, lisp_code, lisp_tokens, lisp_eval = test_lisp(
+                len(lisp_cases), depth, cases=lisp_cases
+            )
         lisp_value_rates.append(lisp_value)
         lisp_code_rates.append(lisp_code)
         lisp_evaluable.append(lisp_eval)
         
         print("\nTesting Standard expressions...")
-        expr_value, expr_code, expr_tokens, expr_eval = test_expr(num_tests, depth)
+        if concurrency:
+            expr_value, expr_code, expr_tokens, expr_eval = asyncio.run(test_expr_async(
+                len(expr_cases), depth, cases=expr_cases, concurrency=concurrency
+            ))
+        else:
+            expr_value, expr_code, expr_tokens, expr_eval = test_expr(
+                len(expr_cases), depth, cases=expr_cases
+            )
         expr_value_rates.append(expr_value)
         expr_code_rates.append(expr_code)
         expr_evaluable.append(expr_eval)
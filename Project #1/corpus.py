@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+import lisp_ast
+from canonical import canonical_digest
+from code_parser import parse_code
+from generators import GeneratedExpression, generate_expression
+
+MANIFEST = 'manifest.json'
+
+def shard_seed(seed: int, depth: int, shard: int) -> int:
+    """The seed for one shard; it depends only on the corpus seed, the depth and the shard number."""
+    digest = hashlib.blake2b(f"{seed}/{depth}/{shard}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def _lisp_value(generated: GeneratedExpression):
+    return lisp_ast.eval(lisp_ast.parse(generated.lisp), lisp_ast.standard_env())
+
+# With dedupe, a depth counts as exhausted after this many duplicates in a row (depth 1 has only 10 trees)
+MAX_DUPLICATES_IN_A_ROW = 1000
+
+def _build_shards(directory: str, depth: int, shards: list, seed: int, dedupe: bool = False) -> list:
+    """
+    Generates the (shard number, count) shards of one depth in order and returns their manifest entries.
+
+    With dedupe, trees canonically equal to one already written to these
+    shards are skipped, and generation stops early once no new trees turn up.
+    """
+    seen = set()
+    entries = []
+    exhausted = False
+    for shard, count in shards:
+        if exhausted:
+            break
+        rng = random.Random(shard_seed(seed, depth, shard))
+        name = f"depth{depth:02d}-{shard:04d}.jsonl"
+        path = os.path.join(directory, name)
+        written = duplicates = 0
+        with open(path + '.tmp', 'w') as f:
+            while written < count:
+                generated = generate_expression(depth, rng)
+                if dedupe:
+                    digest = canonical_digest(generated.tree)
+                    if digest in seen:
+                        duplicates += 1
+                        if duplicates >= MAX_DUPLICATES_IN_A_ROW:
+                            exhausted = True
+                            break
+                        continue
+                    duplicates = 0
+                try:
+                    # Every format gets the same trees, so skip the rare tree that only divides by zero under lisp_ast's /
+                    lisp_value = _lisp_value(generated)
+                except ZeroDivisionError:
+                    continue
+                if dedupe:
+                    seen.add(digest)
+                f.write(json.dumps({
+                    'depth': depth,
+                    'value': generated.value,
+                    'lisp_value': lisp_value,
+                    'infix': generated.infix,
+                    'code': generated.code,
+                    'lisp': generated.lisp,
+                    'lisp_infix': generated.lisp_infix,
+                }) + '\n')
+                written += 1
+        os.replace(path + '.tmp', path)
+        entries.append({'file': name, 'depth': depth, 'shard': shard, 'count': written,
+                        'seed': shard_seed(seed, depth, shard)})
+    return entries
+
+def build_corpus(directory: str, depths=range(1, 7), per_depth: int = 25, seed: int = 0,
+                 shard_size: int = 1000, workers: Optional[int] = None, dedupe: bool = False) -> "Corpus":
+    """
+    Generates per_depth trees for every depth and writes them as sharded JSONL files.
+
+    Each shard is built from its own seed derived from (seed, depth, shard), so
+    the corpus is the same whatever the number of workers or the order shards
+    finish in. Every record holds the tree in each format together with its
+    expected values under Expr (truncating) and lisp_ast (true) division.
+
+    Args:
+        directory (str): Where to write the shards and manifest.json
+        depths: Depths to generate
+        per_depth (int): Trees per depth
+        seed (int): Corpus seed
+        shard_size (int): Trees per shard file
+        workers (int, optional): Process pool size; defaults to every usable
+            core, and 1 builds in this process
+        dedupe (bool): Skip trees canonically equal to an earlier one of the
+            same depth (see canonical.py). The shards of a depth are then
+            built one after another, and a depth with fewer than per_depth
+            distinct trees ends up with fewer.
+
+    Returns:
+        Corpus: The finished corpus
+    """
+    os.makedirs(directory, exist_ok=True)
+    shards = {depth: [(shard, min(shard_size, per_depth - start))
+                      for shard, start in enumerate(range(0, per_depth, shard_size))]
+              for depth in depths}
+    if dedupe:
+        jobs = [(directory, depth, shards[depth], seed, True) for depth in depths]
+    else:
+        jobs = [(directory, depth, [shard], seed, False) for depth in depths for shard in shards[depth]]
+    if workers is None:
+        workers = getattr(os, 'process_cpu_count', os.cpu_count)() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        entries = [_build_shards(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+            entries = list(pool.map(_build_shards, *zip(*jobs)))
+
+    manifest = {'seed': seed, 'depths': list(depths), 'per_depth': per_depth,
+                'shard_size': shard_size, 'dedupe': dedupe,
+                'shards': [entry for job_entries in entries for entry in job_entries]}
+    with open(os.path.join(directory, MANIFEST + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(directory, MANIFEST + '.tmp'), os.path.join(directory, MANIFEST))
+    return Corpus(directory)
+
+class Corpus:
+    """
+    A corpus written by build_corpus(), read shard by shard.
+
+        corpus = Corpus("corpus")
+        for case in corpus.cases(3, true_division=True):
+            ...  # case.lisp, case.lisp_infix, case.value
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+
+    @property
+    def depths(self) -> List[int]:
+        return self.manifest['depths']
+
+    def count(self, depth: int) -> int:
+        return sum(shard['count'] for shard in self.manifest['shards'] if shard['depth'] == depth)
+
+    def records(self, depth: int) -> Iterator[Dict]:
+        """The raw JSON records of one depth, in shard order."""
+        for shard in self.manifest['shards']:
+            if shard['depth'] != depth:
+                continue
+            with open(os.path.join(self.directory, shard['file'])) as f:
+                for line in f:
+                    yield json.loads(line)
+
+    def cases(self, depth: int, limit: Optional[int] = None, true_division: bool = False) -> List[GeneratedExpression]:
+        """
+        The first limit trees of one depth, with value set for Expr
+        (truncating) or lisp_ast (true_division) semantics.
+        """
+        cases = []
+        for record in self.records(depth):
+            if limit is not None and len(cases) >= limit:
+                break
+            cases.append(GeneratedExpression(
+                tree=parse_code(record['code']),
+                value=record['lisp_value'] if true_division else record['value'],
+                infix=record['infix'],
+                code=record['code'],
+                lisp=record['lisp'],
+                lisp_infix=record['lisp_infix'],
+            ))
+        return cases
+
+    def batch(self, depth: int, limit: Optional[int] = None):
+        """
+        The first limit trees of one depth packed for batch_eval (Expr
+        semantics), straight from the records' Lisp text.
+        """
+        from batch_eval import ExprBatch  # needs NumPy, which nothing else here does
+        programs = []
+        for record in self.records(depth):
+            if limit is not None and len(programs) >= limit:
+                break
+            programs.append(record['lisp'])
+        return ExprBatch.from_lisp(programs)
+
+def open_corpus(directory: str, depths=range(1, 7), per_depth: int = 25, seed: int = 0,
+                dedupe: bool = False, **kwargs) -> Corpus:
+    """Opens the corpus in directory, building it first if it's missing or was built for fewer trees."""
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        corpus = Corpus(directory)
+        manifest = corpus.manifest
+        if (manifest['seed'] == seed and manifest.get('dedupe', False) == dedupe
+                and manifest['per_depth'] >= per_depth and set(depths) <= set(manifest['depths'])):
+            return corpus
+    return build_corpus(directory, depths, per_depth, seed, dedupe=dedupe, **kwargs)
@@ -1,5 +1,6 @@
 from openai import OpenAI
 from expressions import Number, Add, Sub, Mul, Div, Expr
+from code_parser import parse_code
 
 def read_api_key(filename="../api/openaikey.txt"):
     try:
@@ -50,7 +51,7 @@ response = client.chat.completions.create(
 expression_code = response.choices[0].message.content.strip()
 print("\nConstructed expression:", expression_code)
 
-expr = eval(expression_code, {"Number": Number, "Add": Add, "Sub": Sub, "Mul": Mul, "Div": Div})
+expr = parse_code(expression_code, lenient=True)
 print("Type of expr:", type(expr))
 result = expr.eval()
 print("Result:", result)
@@ -1,23 +1,16 @@
-from openai import OpenAI
+from api_client import get_async_client, get_client
 import random
-from expressions import Number, Add, Sub, Mul, Div, Expr
-from datetime import datetime, timedelta
+from expressions import Expr, render
+from generators import generate_expression
+from harness import GradeTotals, complete_all, grade_expression, grade_responses
 
 # Set random seed for reproducibility
 random.seed(42)
 
-def read_api_key(filename="../api/openaikey.txt"):
-    try:
-        with open(filename, 'r') as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Please create a {filename} file with your OpenAI API key")
-    except Exception as e:
-        raise Exception(f"Error reading API key: {e}")
+# Setup OpenAI client; repeated requests are answered from the on-disk response cache
+client = get_client()
 
-# Setup OpenAI client
-api_key = read_api_key()
-client = OpenAI(api_key=api_key)
+PROMPT_FILE = "prompts/exp_gpt_prompt.txt"
 
 def generate_random_expression(max_depth=4) -> Expr:
     """
@@ -29,72 +22,35 @@ def generate_random_expression(max_depth=4) -> Expr:
     Returns:
         Expr: A randomly generated expression
     """
-    # Base case: at max depth return a number
-    if max_depth <= 1:
-        return Number(random.randint(1, 10))
-    
-    # Choose a random operator
-    operators = [Add, Sub, Mul, Div]
-    op = random.choice(operators)
-    
-    # Generate left and right expressions with reduced depth
-    left = generate_random_expression(max_depth - 1)
-    right = generate_random_expression(max_depth - 1)
-    
-    # For division, ensure we don't divide by zero
-    if op == Div:
-        # If right side evaluates to 0, replace it with a random number
-        try:
-            if right.eval() == 0:
-                right = Number(random.randint(1, 10))
-        except:
-            # If evaluation fails, try generating a new right expression
-            # that doesn't cause division by zero
-            right = generate_random_expression(max_depth - 1)
-            while True:
-                try:
-                    if right.eval() == 0:
-                        right = generate_random_expression(max_depth - 1)
-                    else:
-                        break
-                except:
-                    right = generate_random_expression(max_depth - 1)
-            
-    return op(left, right)
+    return generate_expression(max_depth).tree
 
-    # Recursively build the code format string
 def get_code_format(e):
-    if isinstance(e, Number):
-        return f"Number({e.value})"
-    return f"{e.__class__.__name__}({get_code_format(e.left)}, {get_code_format(e.right)})"
+    return render(e, 'code')
     
 
-def test_gpt_expression_conversion(num_tests: int, depth: int, model: str = "gpt-3.5-turbo") -> tuple[float, float]:
+def test_gpt_expression_conversion(num_tests: int, depth: int, model: str = "gpt-3.5-turbo", cases=None) -> tuple[float, float]:
     """
     Tests GPT's ability to convert random expressions of given depth, returns success rates.
     
     Args:
         num_tests (int): Number of random expressions to test
         depth (int): Maximum depth of generated expressions
+        cases (list, optional): Pre-generated test cases (e.g. from corpus.Corpus.cases)
+            to use instead of generating num_tests new ones
         input_token_cost_per_million (float): Cost per 1M input tokens (default: $1.50 for GPT-3.5-turbo)
         output_token_cost_per_million (float): Cost per 1M output tokens (default: $2.00 for GPT-3.5-turbo)
         
     Returns:
         tuple[float, float]: (value_match_rate, code_match_rate)
     """
-    system_message = open("prompts/exp_gpt_prompt.txt", "r").read()
-
-    value_matches = 0
-    code_matches = 0
-    total_evaluable = 0
-    total_parseable = 0  # New counter for expressions that can be parsed
-    total_tokens = 0
+    system_message = open(PROMPT_FILE, "r").read()
+    totals = GradeTotals()
 
     for i in range(num_tests):
-        expr = generate_random_expression(depth)
-        expression = str(expr)
+        generated = cases[i] if cases is not None else generate_expression(depth)
+        expression = generated.infix
         print(f"\nTest {i+1}/{num_tests}")
-        print(f"Testing expression: {expression}")
+        print(describe_case(generated))
         
         try:
             response = client.chat.completions.create(
@@ -107,60 +63,34 @@ def test_gpt_expression_conversion(num_tests: int, depth: int, model: str = "gpt
             )
             
             # Track token usage
-            total_tokens += response.usage.prompt_tokens + response.usage.completion_tokens
-            
-            expression_code = response.choices[0].message.content.strip()
-            print(f"Generated code: {expression_code}")
-            
-            # Always attempt string matching
-            original_code = get_code_format(expr)
-            total_parseable += 1  # Count this as a parseable attempt
-            if original_code == expression_code:
-                code_matches += 1
-                print("String representation match!")
-            else:
-                print("String representation mismatch!")
-                print(f"Original code format: {original_code}")
-                print(f"Generated code format: {expression_code}")
-            
-            try:
-                # Try to parse and evaluate
-                generated_expr = eval(expression_code, {"Number": Number, "Add": Add, "Sub": Sub, "Mul": Mul, "Div": Div})
-                original_result = expr.eval()
-                generated_result = generated_expr.eval()
-                
-                # If we get here, both expressions were successfully evaluated
-                total_evaluable += 1
-                
-                if original_result == generated_result:
-                    value_matches += 1
-                    print(f"Evaluation match: both = {original_result}")
-                else:
-                    print(f"Evaluation mismatch!")
-                    print(f"Original expression evaluates to: {original_result}")
-                    print(f"Generated expression evaluates to: {generated_result}")
-                    
-            except ZeroDivisionError:
-                print("Evaluation skipped: Division by zero")
-            except Exception as e:
-                print(f"Error in parsing or evaluation: {str(e)}")
+            totals.add_usage(response)
+            grade_expression(generated, response.choices[0].message.content.strip(), totals)
                 
         except Exception as e:
             print(f"API or other error: {str(e)}")
     
-    # Calculate success rates
-    value_success_rate = value_matches / total_evaluable if total_evaluable > 0 else 0.0
-    code_success_rate = code_matches / total_parseable if total_parseable > 0 else 0.0
-    
-    print(f"\nOverall Results:")
-    print(f"Total tests: {num_tests}")
-    print(f"Successfully parsed: {total_parseable}")
-    print(f"Successfully evaluated: {total_evaluable}")
-    print(f"Value match success rate: {value_success_rate:.2%}")
-    print(f"Code match success rate: {code_success_rate:.2%}")
-    print(f"Total tokens used: {total_tokens}")
-    
-    return value_success_rate, code_success_rate, total_tokens, total_evaluable
+    return totals.report(num_tests)
+
+async def test_gpt_expression_conversion_async(num_tests: int, depth: int, model: str = "gpt-3.5-turbo",
+                                               cases=None, concurrency: int = 8) -> tuple[float, float, int, int]:
+    """
+    Like test_gpt_expression_conversion, but with up to concurrency requests in flight at once.
+
+    Every request is sent first; the answers are then graded and printed in
+    test order, and aggregated into the same tuple of rates and tokens.
+
+        asyncio.run(test_gpt_expression_conversion_async(25, 4, concurrency=16))
+    """
+    system_message = open(PROMPT_FILE, "r").read()
+    cases = [cases[i] if cases is not None else generate_expression(depth) for i in range(num_tests)]
+    # A client per run: its connection pool belongs to this run's event loop
+    async with get_async_client() as async_client:
+        responses = await complete_all(async_client, model, system_message,
+                                       [generated.infix for generated in cases], concurrency)
+    return grade_responses(cases, responses, grade_expression, describe_case)
+
+def describe_case(generated) -> str:
+    return f"Testing expression: {generated.infix}"
 
 # Example usage:
 if __name__ == "__main__":
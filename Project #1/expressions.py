@@ -1,91 +1,389 @@
-from abc import ABC, abstractmethod
+from abc import ABC
+import keyword
+import operator
 
 class Expr(ABC):
-    @abstractmethod
-    def eval(self)->int:
-        pass
-        
-    @abstractmethod
+    # Nodes are immutable: children and values are fixed at construction, the
+    # structural hash is computed once, and value/string are cached lazily.
+    __slots__ = ('_hash', '_value', '_str', '_compiled')
+
+    def eval(self, env=None)->int:
+        if self._value is None:
+            return evaluate(self, env)
+        return self._value
+
+    def compile(self):
+        """Returns a flat Python function computing this expression, cached on the node."""
+        if self._compiled is None:
+            object.__setattr__(self, '_compiled', compile_expr(self))
+        return self._compiled
+
     def __str__(self)->str:
-        pass
+        if self._str is None:
+            object.__setattr__(self, '_str', render(self))
+        return self._str
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} nodes are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} nodes are immutable")
+
+    def __hash__(self)->int:
+        return self._hash
+
+    def __reduce__(self):
+        # Pickle as the compact pre-order encoding, which also avoids recursing on deep trees
+        from serialization import encode_expr, decode_expr
+        return (decode_expr, (encode_expr(self),))
+
+    def __eq__(self, other)->bool:
+        if self is other:
+            return True
+        if not isinstance(other, Expr):
+            return NotImplemented
+        # Compare iteratively so deep trees don't hit the recursion limit
+        stack = [(self, other)]
+        while stack:
+            a, b = stack.pop()
+            if a is b:
+                continue
+            if type(a) is not type(b) or a._hash != b._hash:
+                return False
+            if isinstance(a, Number):
+                if a.value != b.value:
+                    return False
+            elif isinstance(a, Var):
+                if a.name != b.name:
+                    return False
+            else:
+                stack.append((a.right, b.right))
+                stack.append((a.left, b.left))
+        return True
 
 class Number(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         if not isinstance(value, int):
             raise TypeError("Value must be an integer")
-        self.value = value
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, '_hash', hash((Number, value)))
+        object.__setattr__(self, '_value', value)
+        object.__setattr__(self, '_str', None)
+        object.__setattr__(self, '_compiled', None)
 
-    def eval(self)->int:
-        return self.value
-        
-    def __str__(self)->str:
-        return str(self.value)
+class Var(Expr):
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        if not (isinstance(name, str) and name.isidentifier()) or keyword.iskeyword(name) or name.startswith('_'):
+            raise TypeError("Name must be an identifier that doesn't start with an underscore")
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, '_hash', hash((Var, name)))
+        # A variable's value depends on the bindings, so it's never cached
+        object.__setattr__(self, '_value', None)
+        object.__setattr__(self, '_str', None)
+        object.__setattr__(self, '_compiled', None)
+
+class BinaryOp(Expr):
+    __slots__ = ('left', 'right')
 
-class Add(Expr):
     def __init__(self, left: Expr, right: Expr):
         if not (isinstance(left, Expr) and isinstance(right, Expr)):
             raise TypeError("Both arguments must be Expr instances")
-        self.left = left
-        self.right = right
+        object.__setattr__(self, 'left', left)
+        object.__setattr__(self, 'right', right)
+        object.__setattr__(self, '_hash', hash((type(self), left._hash, right._hash)))
+        object.__setattr__(self, '_value', None)
+        object.__setattr__(self, '_str', None)
+        object.__setattr__(self, '_compiled', None)
 
-    def eval(self)->int:
-        return self.left.eval() + self.right.eval()
-        
-    def __str__(self)->str:
+
+class Add(BinaryOp):
+    __slots__ = ()
+    symbol = '+'
+    lisp_name = 'add'
+
+    def _needs_parens(self, operand: Expr)->bool:
         # Add/Sub need parentheses when they're inside other operations
-        left_str = f"({str(self.left)})" if isinstance(self.left, (Add, Sub)) else str(self.left)
-        right_str = f"({str(self.right)})" if isinstance(self.right, (Add, Sub)) else str(self.right)
-        return f"{left_str} + {right_str}"
+        return isinstance(operand, (Add, Sub))
 
-class Sub(Expr):
-    def __init__(self, left: Expr, right: Expr):
-        if not (isinstance(left, Expr) and isinstance(right, Expr)):
-            raise TypeError("Both arguments must be Expr instances")
-        self.left = left
-        self.right = right
+class Sub(BinaryOp):
+    __slots__ = ()
+    symbol = '-'
+    lisp_name = 'sub'
 
-    def eval(self)->int:
-        return self.left.eval() - self.right.eval()
-        
-    def __str__(self)->str:
+    def _needs_parens(self, operand: Expr)->bool:
         # Add/Sub need parentheses when they're inside other operations
-        left_str = f"({str(self.left)})" if isinstance(self.left, (Add, Sub)) else str(self.left)
-        right_str = f"({str(self.right)})" if isinstance(self.right, (Add, Sub)) else str(self.right)
-        return f"{left_str} - {right_str}"
+        return isinstance(operand, (Add, Sub))
 
-class Mul(Expr):
-    def __init__(self, left: Expr, right: Expr):
-        if not (isinstance(left, Expr) and isinstance(right, Expr)):
-            raise TypeError("Both arguments must be Expr instances")
-        self.left = left
-        self.right = right
+class Mul(BinaryOp):
+    __slots__ = ()
+    symbol = '*'
+    lisp_name = 'mul'
 
-    def eval(self)->int:
-        return self.left.eval() * self.right.eval()
-        
-    def __str__(self)->str:
-        # Always wrap the operands in parentheses if they're not simple numbers
-        left_str = str(self.left) if isinstance(self.left, Number) else f"({str(self.left)})"
-        right_str = str(self.right) if isinstance(self.right, Number) else f"({str(self.right)})"
-        return f"{left_str} * {right_str}"
+    def _needs_parens(self, operand: Expr)->bool:
+        # Always wrap the operands in parentheses if they're not numbers or variables
+        return not isinstance(operand, (Number, Var))
 
-class Div(Expr):
-    def __init__(self, left: Expr, right: Expr):
-        if not (isinstance(left, Expr) and isinstance(right, Expr)):
-            raise TypeError("Both arguments must be Expr instances")
-        self.left = left
-        self.right = right
-
-    def eval(self)->int:
-        if self.right.eval() == 0:
-            raise ZeroDivisionError("Division by zero")
-        return int(self.left.eval() / self.right.eval())
-        
-    def __str__(self)->str:
-        # Always wrap the operands in parentheses if they're not simple numbers
-        left_str = str(self.left) if isinstance(self.left, Number) else f"({str(self.left)})"
-        right_str = str(self.right) if isinstance(self.right, Number) else f"({str(self.right)})"
-        return f"{left_str} / {right_str}"
+class Div(BinaryOp):
+    __slots__ = ()
+    symbol = '/'
+    lisp_name = 'div'
+
+    def _needs_parens(self, operand: Expr)->bool:
+        # Always wrap the operands in parentheses if they're not numbers or variables
+        return not isinstance(operand, (Number, Var))
+
+def truncating_div(a: int, b: int) -> int:
+    """Integer division that rounds toward zero, like int(a / b) but exact for big ints."""
+    if b == 0:
+        raise ZeroDivisionError("Division by zero")
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+_BINARY_OPS = {
+    Add: operator.add,
+    Sub: operator.sub,
+    Mul: operator.mul,
+    Div: truncating_div,
+}
+
+def evaluate(expr: Expr, env=None) -> int:
+    """
+    Evaluates an expression tree without recursion.
+
+    Walks the tree in post-order with an explicit stack, so every node is
+    visited exactly once and arbitrarily deep trees don't hit the recursion limit.
+    Each node's value is cached on it, so shared subtrees and repeated calls are
+    not recomputed. Values computed under variable bindings are not cached.
+
+    Args:
+        expr (Expr): The expression to evaluate
+        env (Mapping[str, int], optional): Values for the Var nodes in the tree
+
+    Returns:
+        int: The value of the expression
+    """
+    values = []
+    stack = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if node._value is not None:
+            values.append(node._value)
+        elif isinstance(node, Var):
+            if env is None or node.name not in env:
+                raise NameError(f"Unbound variable: {node.name}")
+            values.append(env[node.name])
+        elif children_done:
+            right = values.pop()
+            left = values.pop()
+            value = _BINARY_OPS[type(node)](left, right)
+            if env is None:
+                object.__setattr__(node, '_value', value)
+            values.append(value)
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+    return values[0]
+
+RENDER_FORMATS = ('infix', 'code', 'lisp')
+
+def _render_parts(node: Expr, fmt: str) -> list:
+    """The pieces one node expands into: strings are output, Expr items get expanded in turn."""
+    if isinstance(node, Number):
+        if fmt == 'code':
+            return [f"Number({node.value})"]
+        if fmt == 'lisp':
+            return [f"(number {node.value})"]
+        return [str(node.value)]
+    if isinstance(node, Var):
+        return [f"Var('{node.name}')" if fmt == 'code' else node.name]
+    if fmt == 'code':
+        return [f"{type(node).__name__}(", node.left, ", ", node.right, ")"]
+    if fmt == 'lisp':
+        return [f"({node.lisp_name} ", node.left, " ", node.right, ")"]
+    parts = []
+    for i, operand in enumerate((node.left, node.right)):
+        if i:
+            parts.append(f" {node.symbol} ")
+        if node._needs_parens(operand):
+            parts.extend(("(", operand, ")"))
+        else:
+            parts.append(operand)
+    return parts
+
+def render(expr: Expr, fmt: str = 'infix', sink=None):
+    """
+    Renders an expression tree as infix, code-format or Lisp text.
+
+    The tree is expanded with an explicit stack and every piece of text is
+    produced exactly once, so rendering is linear in the output size at any depth.
+
+    Args:
+        expr (Expr): The expression to render
+        fmt (str): 'infix' (same as str(expr)), 'code' (Add(Number(1), ...)) or
+            'lisp' ((add (number 1) ...))
+        sink (optional): A list to extend with the text pieces, or any object with
+            a write() method (such as an open file). If omitted the text is returned.
+
+    Returns:
+        str or None: The rendered text when no sink is given
+    """
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {RENDER_FORMATS}")
+    parts = []
+    write = sink.write if hasattr(sink, 'write') else None
+    stack = [expr]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            if write is not None and len(parts) >= 4096:
+                write("".join(parts))
+                parts.clear()
+        elif fmt == 'infix' and item._str is not None:
+            parts.append(item._str)
+        else:
+            stack.extend(reversed(_render_parts(item, fmt)))
+    if write is not None:
+        write("".join(parts))
+    elif sink is not None:
+        sink.extend(parts)
+    else:
+        return "".join(parts)
+
+_OP_SOURCE = {
+    Add: "{} + {}",
+    Sub: "{} - {}",
+    Mul: "{} * {}",
+    Div: "_tdiv({}, {})",
+}
+
+def compile_expr(expr: Expr):
+    """
+    Lowers an expression tree into a single Python function.
+
+    The tree is emitted as straight-line code (one assignment per operator node,
+    numbers inlined as literals) and compiled once, so calling the result does no
+    per-node dispatch. Shared subtrees are emitted once, and since the code is
+    flat, any depth compiles without hitting the parser's nesting limits.
+    Var nodes become parameters of the function, in sorted name order.
+
+    Args:
+        expr (Expr): The expression to compile
+
+    Returns:
+        Callable[..., int]: A function that evaluates the expression
+    """
+    lines = [None]  # header is filled in once the variables are known
+    params = set()
+    names = {}  # id(node) -> source operand for that node
+    stack = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if id(node) in names:
+            continue
+        if isinstance(node, Number):
+            names[id(node)] = f"({node.value!r})"
+        elif isinstance(node, Var):
+            params.add(node.name)
+            names[id(node)] = node.name
+        elif children_done:
+            name = f"_t{len(lines)}"
+            source = _OP_SOURCE[type(node)].format(names[id(node.left)], names[id(node.right)])
+            lines.append(f"    {name} = {source}")
+            names[id(node)] = name
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+    lines.append(f"    return {names[id(expr)]}")
+    lines[0] = f"def _compiled({', '.join(sorted(params))}):"
+    namespace = {"_tdiv": truncating_div}
+    exec(compile("\n".join(lines), "<compiled Expr>", "exec"), namespace)
+    return namespace["_compiled"]
+
+class ExprInterner:
+    """
+    Hash-conses expression nodes so structurally equal subtrees share one object.
+
+    Building trees through an interner (or passing existing trees to intern())
+    turns a corpus into a DAG: every distinct subtree is stored once, and its
+    cached value and string are computed at most once. New nodes are published
+    with dict.setdefault, so threads racing on the same key all get one node.
+    """
+
+    def __init__(self):
+        self._table = {}
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def clear(self):
+        self._table.clear()
+
+    def number(self, value: int) -> Number:
+        key = (Number, value, type(value))
+        node = self._table.get(key)
+        if node is None:
+            node = self._table.setdefault(key, Number(value))
+        return node
+
+    def var(self, name: str) -> Var:
+        key = (Var, name)
+        node = self._table.get(key)
+        if node is None:
+            node = self._table.setdefault(key, Var(name))
+        return node
+
+    def make(self, op: type, left: Expr, right: Expr) -> Expr:
+        """Returns the shared op(left, right) node; left and right must already be interned."""
+        key = (op, id(left), id(right))
+        node = self._table.get(key)
+        if node is None:
+            node = self._table.setdefault(key, op(left, right))
+        return node
+
+    def add(self, left: Expr, right: Expr) -> Add:
+        return self.make(Add, left, right)
+
+    def sub(self, left: Expr, right: Expr) -> Sub:
+        return self.make(Sub, left, right)
+
+    def mul(self, left: Expr, right: Expr) -> Mul:
+        return self.make(Mul, left, right)
+
+    def div(self, left: Expr, right: Expr) -> Div:
+        return self.make(Div, left, right)
+
+    def intern(self, expr: Expr) -> Expr:
+        """Returns the shared node structurally equal to expr, interning every subtree."""
+        results = []
+        stack = [(expr, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if isinstance(node, Number):
+                results.append(self.number(node.value))
+            elif isinstance(node, Var):
+                results.append(self.var(node.name))
+            elif children_done:
+                right = results.pop()
+                left = results.pop()
+                results.append(self.make(type(node), left, right))
+            else:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+        return results[0]
+
+default_interner = ExprInterner()
+
+def intern_expr(expr: Expr) -> Expr:
+    """Interns expr in the module-wide default_interner."""
+    return default_interner.intern(expr)
 
 def test(num1: Expr, num2: Expr):
     add = Add(num1, num2)
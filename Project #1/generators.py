@@ -0,0 +1,91 @@
+import operator
+import random
+from typing import NamedTuple, Optional, Union
+from expressions import Number, Add, Sub, Mul, Div, Expr, render, truncating_div
+from ir import ExprIR
+
+OPERATORS = (Add, Sub, Mul, Div)
+
+class GeneratedExpression(NamedTuple):
+    tree: Expr
+    value: Union[int, float]   # the tree's value under the division the generator used
+    infix: str                 # str(tree), as shown in the Expr prompts
+    code: str                  # Add(Number(1), ...) code format
+    lisp: str                  # (add (number 1) ...) Lisp format
+    lisp_infix: str            # infix with minimal parentheses, as shown in the Lisp prompts
+
+def generate_expression(max_depth: int = 4, rng: random.Random = random, true_division: bool = False,
+                        max_abs: Optional[int] = None) -> GeneratedExpression:
+    """
+    Generates a complete random expression tree together with its value and renderings.
+
+    The tree is built bottom-up in one iterative pass while carrying each
+    subtree's value, so nothing is ever re-evaluated: a division whose divisor
+    is 0 gets a random number 1-10 as its divisor instead. Random numbers are
+    drawn in the same order as the old recursive generators, so a given seed
+    still produces the same trees.
+
+    Args:
+        max_depth (int): Depth of the tree; leaves are numbers 1-10
+        rng: Source of randomness, e.g. random.Random(seed)
+        true_division (bool): Track values as lisp_ast does (div is /)
+            instead of as Expr does (truncating integer division)
+        max_abs (int, optional): Keep every subtree's value within
+            [-max_abs, max_abs] by re-picking operators that would leave it;
+            must be at least 10
+
+    Returns:
+        GeneratedExpression: The tree, its value, and its infix, code, Lisp
+            and Lisp-prompt infix renderings
+    """
+    if max_abs is not None and max_abs < 10:
+        raise ValueError("max_abs must be at least 10, the largest leaf")
+    divide = operator.truediv if true_division else truncating_div
+    apply = {Add: operator.add, Sub: operator.sub, Mul: operator.mul, Div: divide}
+
+    done = []  # (node, value) for finished subtrees, left before right
+    stack = [(max_depth, None)]
+    while stack:
+        depth, op = stack.pop()
+        if op is None:
+            if depth <= 1:
+                value = rng.randint(1, 10)
+                done.append((Number(value), value))
+            else:
+                # Choose the operator before building the operands, as the recursive version did
+                stack.append((depth, rng.choice(OPERATORS)))
+                stack.append((depth - 1, None))
+                stack.append((depth - 1, None))
+            continue
+
+        (left, a), (right, b) = done[-2], done[-1]
+        del done[-2:]
+        if op is Div and b == 0:
+            b = rng.randint(1, 10)
+            right = Number(b)
+        value = apply[op](a, b)
+        if max_abs is not None and abs(value) > max_abs:
+            for candidate in rng.sample(OPERATORS, len(OPERATORS)):
+                if candidate is not Div or b != 0:
+                    value = apply[candidate](a, b)
+                    if abs(value) <= max_abs:
+                        op = candidate
+                        break
+            else:
+                # Dividing by a number 1-10 never grows a bounded value
+                b = rng.randint(1, 10)
+                right, op, value = Number(b), Div, divide(a, b)
+        done.append((op(left, right), value))
+
+    return generated_from(*done[0])
+
+def generated_from(tree: Expr, value: Union[int, float]) -> GeneratedExpression:
+    """Bundles a tree and its known value with all of its renderings."""
+    return GeneratedExpression(
+        tree=tree,
+        value=value,
+        infix=str(tree),
+        code=render(tree, 'code'),
+        lisp=render(tree, 'lisp'),
+        lisp_infix=ExprIR.from_expr(tree).to_infix(),
+    )
@@ -0,0 +1,195 @@
+import asyncio
+from typing import Callable, List
+from canonical import equivalent
+from code_parser import parse_code
+from generators import GeneratedExpression
+from lisp_ast import eval, parse
+from tree_diff import compare
+
+class GradeTotals:
+    """Running counts for one test_gpt_expression_conversion run."""
+
+    def __init__(self):
+        self.value_matches = 0
+        self.code_matches = 0
+        self.equivalent_matches = 0  # code matches plus outputs that only reorder or regroup add/mul operands
+        self.total_evaluable = 0
+        self.total_parseable = 0
+        self.total_tokens = 0
+
+    def add_usage(self, response):
+        """Counts a response's tokens, unless it came from the response cache and cost nothing."""
+        if not getattr(response, 'cached', False):
+            self.total_tokens += response.usage.prompt_tokens + response.usage.completion_tokens
+
+    def report(self, num_tests: int) -> tuple:
+        """
+        Prints the overall results.
+
+        Returns:
+            tuple[float, float, int, int]: (value_match_rate, code_match_rate, total_tokens, total_evaluable)
+        """
+        value_success_rate = self.value_matches / self.total_evaluable if self.total_evaluable > 0 else 0.0
+        code_success_rate = self.code_matches / self.total_parseable if self.total_parseable > 0 else 0.0
+        equivalent_success_rate = self.equivalent_matches / self.total_parseable if self.total_parseable > 0 else 0.0
+
+        print(f"\nOverall Results:")
+        print(f"Total tests: {num_tests}")
+        print(f"Successfully parsed: {self.total_parseable}")
+        print(f"Successfully evaluated: {self.total_evaluable}")
+        print(f"Value match success rate: {value_success_rate:.2%}")
+        print(f"Code match success rate: {code_success_rate:.2%}")
+        print(f"Equivalent match success rate: {equivalent_success_rate:.2%}")
+        print(f"Total tokens used: {self.total_tokens}")
+
+        return value_success_rate, code_success_rate, self.total_tokens, self.total_evaluable
+
+def grade_expression(generated: GeneratedExpression, expression_code: str, totals: GradeTotals):
+    """Grades a model's code-format answer for an Expr test case, printing what it finds."""
+    print(f"Generated code: {expression_code}")
+
+    # Always attempt string matching
+    original_code = generated.code
+    totals.total_parseable += 1  # Count this as a parseable attempt
+    if original_code == expression_code:
+        totals.code_matches += 1
+        totals.equivalent_matches += 1
+        print("String representation match!")
+    else:
+        print("String representation mismatch!")
+        print(f"Original code format: {original_code}")
+        print(f"Generated code format: {expression_code}")
+
+    try:
+        # Try to parse and evaluate
+        generated_expr = parse_code(expression_code)
+        if original_code != expression_code:
+            diff = compare(generated.tree, generated_expr)
+            print(f"Structural diff: {diff.classification} at {diff.first_mismatch}, "
+                  f"edit distance {diff.distance}")
+            if equivalent(generated.tree, generated_expr):
+                totals.equivalent_matches += 1
+                print("Equivalent up to the order and grouping of add/mul operands")
+        original_result = generated.value
+        generated_result = generated_expr.eval()
+
+        # If we get here, both expressions were successfully evaluated
+        totals.total_evaluable += 1
+
+        if original_result == generated_result:
+            totals.value_matches += 1
+            print(f"Evaluation match: both = {original_result}")
+        else:
+            print(f"Evaluation mismatch!")
+            print(f"Original expression evaluates to: {original_result}")
+            print(f"Generated expression evaluates to: {generated_result}")
+
+    except ZeroDivisionError:
+        print("Evaluation skipped: Division by zero")
+    except Exception as e:
+        print(f"Error in parsing or evaluation: {str(e)}")
+
+def grade_lisp(generated: GeneratedExpression, generated_lisp: str, totals: GradeTotals):
+    """Grades a model's Lisp answer for a Lisp test case (value under true division), printing what it finds."""
+    lisp_expr = generated.lisp
+    print(f"Generated Lisp: {generated_lisp}")
+
+    # Always attempt string matching
+    totals.total_parseable += 1
+    if generated_lisp == lisp_expr:
+        totals.code_matches += 1
+        totals.equivalent_matches += 1
+        print("String representation match!")
+    else:
+        print("String representation mismatch!")
+        print(f"Original Lisp: {lisp_expr}")
+        print(f"Generated Lisp: {generated_lisp}")
+
+    try:
+        if generated_lisp != lisp_expr:
+            diff = compare(lisp_expr, generated_lisp)
+            print(f"Structural diff: {diff.classification} at {diff.first_mismatch}, "
+                  f"edit distance {diff.distance}")
+            if equivalent(lisp_expr, generated_lisp):
+                totals.equivalent_matches += 1
+                print("Equivalent up to the order and grouping of add/mul operands")
+
+        # Try to parse and evaluate both expressions
+        original_result = generated.value
+        generated_result = eval(parse(generated_lisp))
+
+        totals.total_evaluable += 1
+
+        if original_result == generated_result:
+            totals.value_matches += 1
+            print(f"Evaluation match: both = {original_result}")
+        else:
+            print(f"Evaluation mismatch!")
+            print(f"Original evaluates to: {original_result}")
+            print(f"Generated evaluates to: {generated_result}")
+
+    except ZeroDivisionError:
+        print("Evaluation skipped: Division by zero")
+    except Exception as e:
+        print(f"Error in parsing or evaluation: {str(e)}")
+
+def grade_responses(cases, responses, grade: Callable, describe: Callable[[GeneratedExpression], str]) -> tuple:
+    """
+    Grades answers already collected for cases, printing each in test order.
+
+    Args:
+        cases (list): The test cases
+        responses (list): One chat completion per case, or the exception
+            raised in place of a failed request
+        grade: grade_expression or grade_lisp
+        describe: Returns the text printed under each test's number, e.g. the
+            expression the model was asked to convert
+
+    Returns:
+        tuple[float, float, int, int]: (value_match_rate, code_match_rate, total_tokens, total_evaluable)
+    """
+    totals = GradeTotals()
+
+    for i, (generated, response) in enumerate(zip(cases, responses)):
+        print(f"\nTest {i+1}/{len(cases)}")
+        print(describe(generated))
+        try:
+            if isinstance(response, Exception):
+                raise response
+            totals.add_usage(response)
+            grade(generated, response.choices[0].message.content.strip(), totals)
+        except Exception as e:
+            print(f"API or other error: {str(e)}")
+
+    return totals.report(len(cases))
+
+async def complete_all(client, model: str, system_message: str, user_messages: List[str],
+                       concurrency: int = 8, temperature: float = 0.0) -> list:
+    """
+    Sends one chat completion per user message, at most concurrency at a time.
+
+    Args:
+        client: An AsyncOpenAI (or compatible) client
+        model (str): Model ID
+        system_message (str): System prompt shared by every request
+        user_messages (list[str]): One user message per request
+        concurrency (int): Maximum number of requests in flight
+
+    Returns:
+        list: The responses in the order of user_messages; a request that
+            failed has its exception in its place instead
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def complete(content: str):
+        async with semaphore:
+            return await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": content}
+                ],
+                temperature=temperature
+            )
+
+    return await asyncio.gather(*(complete(content) for content in user_messages), return_exceptions=True)
@@ -0,0 +1,341 @@
+import re
+from array import array
+from typing import Dict
+from expressions import Number, Var, Add, Sub, Mul, Div, Expr
+from code_parser import parse_code
+import lisp_ast
+
+# Opcodes; operator opcodes double as indexes into the tables below
+NUM, VAR, ADD, SUB, MUL, DIV = range(6)
+
+_LISP_NAMES = {ADD: 'add', SUB: 'sub', MUL: 'mul', DIV: 'div'}
+_LISP_OPCODES = {name: code for code, name in _LISP_NAMES.items()}
+_CODE_NAMES = {ADD: 'Add', SUB: 'Sub', MUL: 'Mul', DIV: 'Div'}
+_SYMBOLS = {ADD: '+', SUB: '-', MUL: '*', DIV: '/'}
+_WORDS = {ADD: 'the sum of', SUB: 'the difference of', MUL: 'the product of', DIV: 'the quotient of'}
+_WORDS_OPCODES = {words: code for code, words in _WORDS.items()}
+_SYMBOL_OPCODES = {symbol: code for code, symbol in _SYMBOLS.items()}
+_EXPR_CLASSES = {ADD: Add, SUB: Sub, MUL: Mul, DIV: Div}
+_EXPR_OPCODES = {cls: code for code, cls in _EXPR_CLASSES.items()}
+_PRECEDENCE = {NUM: 3, VAR: 3, ADD: 1, SUB: 1, MUL: 2, DIV: 2}
+
+_INFIX_TOKEN = re.compile(r'\s*(?:(?P<num>\d+\.\d*|\.\d+|\d+)|(?P<name>[A-Za-z_]\w*)|(?P<op>[-+*/()]))')
+_TRAILING_SPACE = re.compile(r'\s*')
+_WORDS_TOKEN = re.compile(r'\s*(?:(?P<op>the (?:sum|difference|product|quotient) of)\b|(?P<and>and)\b'
+                          r'|(?P<num>-?(?:\d+\.\d*|\.\d+|\d+))|(?P<name>[A-Za-z_]\w*))')
+
+class ExprIR:
+    """
+    A compact, format-neutral arithmetic tree that every representation converts through.
+
+    Nodes are rows in post-order (children always before their parent, the root
+    last): an opcode, left and right child rows (-1 for leaves), and a payload
+    holding a number's value or a variable's name. Every from_*/to_* converter
+    is a single iterative pass, so converting once and rendering every format
+    is linear in the size of the tree at any depth.
+    """
+
+    __slots__ = ('ops', 'left', 'right', 'values')
+
+    def __init__(self):
+        self.ops = array('B')
+        self.left = array('q')
+        self.right = array('q')
+        self.values = []
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ExprIR):
+            return NotImplemented
+        return (self.ops == other.ops and self.left == other.left
+                and self.right == other.right and self.values == other.values)
+
+    @property
+    def root(self) -> int:
+        return len(self.ops) - 1
+
+    def _leaf(self, op: int, value) -> int:
+        self.ops.append(op)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.values.append(value)
+        return len(self.ops) - 1
+
+    def _node(self, op: int, left: int, right: int) -> int:
+        self.ops.append(op)
+        self.left.append(left)
+        self.right.append(right)
+        self.values.append(None)
+        return len(self.ops) - 1
+
+    # Converters into the IR
+
+    @classmethod
+    def from_expr(cls, expr: Expr) -> "ExprIR":
+        ir = cls()
+        stack = [(expr, False)]
+        rows = []
+        while stack:
+            node, children_done = stack.pop()
+            if isinstance(node, Number):
+                rows.append(ir._leaf(NUM, node.value))
+            elif isinstance(node, Var):
+                rows.append(ir._leaf(VAR, node.name))
+            elif children_done:
+                right = rows.pop()
+                left = rows.pop()
+                rows.append(ir._node(_EXPR_OPCODES[type(node)], left, right))
+            else:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+        return ir
+
+    @classmethod
+    def from_lisp(cls, program) -> "ExprIR":
+        """From Lisp text or an already parsed lisp_ast expression."""
+        x = lisp_ast.parse(program) if isinstance(program, str) else program
+        ir = cls()
+        stack = [(x, False)]
+        rows = []
+        while stack:
+            item, children_done = stack.pop()
+            if isinstance(item, (int, float)):
+                rows.append(ir._leaf(NUM, item))
+            elif isinstance(item, str):
+                rows.append(ir._leaf(VAR, item))
+            elif len(item) == 2 and item[0] == 'number' and isinstance(item[1], (int, float)):
+                rows.append(ir._leaf(NUM, item[1]))
+            elif len(item) != 3 or item[0] not in _LISP_OPCODES:
+                raise ValueError(f"Not an arithmetic expression: {item!r}")
+            elif children_done:
+                right = rows.pop()
+                left = rows.pop()
+                rows.append(ir._node(_LISP_OPCODES[item[0]], left, right))
+            else:
+                stack.append((item, True))
+                stack.append((item[2], False))
+                stack.append((item[1], False))
+        return ir
+
+    @classmethod
+    def from_code(cls, text: str, lenient: bool = False) -> "ExprIR":
+        """From the Add(Number(1), ...) code format."""
+        return cls.from_expr(parse_code(text, lenient=lenient))
+
+    @classmethod
+    def from_infix(cls, text: str) -> "ExprIR":
+        """
+        From infix text such as "2 * (3 + x) - -4".
+
+        Standard precedence with left-associative operators; a leading minus is
+        only allowed directly on a number literal.
+        """
+        ir = cls()
+        operands = []   # rows
+        operators = []  # opcodes, or '(' markers
+        pos, end = 0, len(text)
+        expect_operand = True
+
+        def reduce():
+            op = operators.pop()
+            right = operands.pop()
+            left = operands.pop()
+            operands.append(ir._node(op, left, right))
+
+        while True:
+            match = _INFIX_TOKEN.match(text, pos)
+            if match is None:
+                skipped = _TRAILING_SPACE.match(text, pos).end()
+                if skipped == end:
+                    break
+                raise SyntaxError(f"unexpected character {text[skipped]!r} at position {skipped}")
+            pos = match.end()
+            kind, token = match.lastgroup, match.group(match.lastgroup)
+            at = match.start(kind)
+            if expect_operand:
+                if kind == 'op' and token == '-' or kind == 'op' and token == '+':
+                    number = _INFIX_TOKEN.match(text, pos)
+                    if number is None or number.lastgroup != 'num':
+                        raise SyntaxError(f"unary {token} must be followed by a number at position {at}")
+                    pos = number.end()
+                    operands.append(ir._leaf(NUM, _number(token + number.group('num'))))
+                    expect_operand = False
+                elif kind == 'num':
+                    operands.append(ir._leaf(NUM, _number(token)))
+                    expect_operand = False
+                elif kind == 'name':
+                    operands.append(ir._leaf(VAR, token))
+                    expect_operand = False
+                elif token == '(':
+                    operators.append('(')
+                else:
+                    raise SyntaxError(f"expected a number, name or '(' at position {at}, got {token!r}")
+            elif kind == 'op' and token in _SYMBOL_OPCODES:
+                op = _SYMBOL_OPCODES[token]
+                while operators and operators[-1] != '(' and _PRECEDENCE[operators[-1]] >= _PRECEDENCE[op]:
+                    reduce()
+                operators.append(op)
+                expect_operand = True
+            elif token == ')':
+                while operators and operators[-1] != '(':
+                    reduce()
+                if not operators:
+                    raise SyntaxError(f"unmatched ')' at position {at}")
+                operators.pop()
+            else:
+                raise SyntaxError(f"expected an operator or ')' at position {at}, got {token!r}")
+
+        if expect_operand:
+            raise SyntaxError("unexpected end of input")
+        while operators:
+            if operators[-1] == '(':
+                raise SyntaxError("unclosed '('")
+            reduce()
+        return ir
+
+    @classmethod
+    def from_words(cls, text: str) -> "ExprIR":
+        """From the words format of to_words(), e.g. "the sum of 2 and the product of 3 and x"."""
+        ir = cls()
+        pending = []  # [opcode, left row or None] of operators still missing an operand
+        pos, end = 0, len(text)
+        expect_and = False
+        root = None
+        while True:
+            pos = _TRAILING_SPACE.match(text, pos).end()
+            if pos == end:
+                break
+            match = _WORDS_TOKEN.match(text, pos)
+            if match is None or root is not None or expect_and != (match.lastgroup == 'and'):
+                raise SyntaxError(f"unexpected {text[pos:pos + 20]!r} at position {pos}")
+            pos = match.end()
+            kind = match.lastgroup
+            if kind == 'and':
+                expect_and = False
+                continue
+            if kind == 'op':
+                pending.append([_WORDS_OPCODES[match.group('op')], None])
+                continue
+            row = ir._leaf(NUM, _number(match.group('num'))) if kind == 'num' else ir._leaf(VAR, match.group('name'))
+            while True:
+                if not pending:
+                    root = row
+                    break
+                if pending[-1][1] is None:
+                    pending[-1][1] = row
+                    expect_and = True
+                    break
+                op, left = pending.pop()
+                row = ir._node(op, left, row)
+        if root is None:
+            raise SyntaxError("unexpected end of input")
+        return ir
+
+    # Converters out of the IR
+
+    def to_expr(self) -> Expr:
+        nodes = []
+        for op, left, right, value in zip(self.ops, self.left, self.right, self.values):
+            if op == NUM:
+                nodes.append(Number(value))
+            elif op == VAR:
+                nodes.append(Var(value))
+            else:
+                nodes.append(_EXPR_CLASSES[op](nodes[left], nodes[right]))
+        return nodes[-1]
+
+    def to_lisp(self) -> str:
+        return self._emit(self._lisp_parts)
+
+    def to_code(self) -> str:
+        return self._emit(self._code_parts)
+
+    def to_infix(self) -> str:
+        """
+        Infix text with only the parentheses needed to rebuild exactly this tree.
+
+        An operand is wrapped when it binds more loosely than its operator, and a
+        right operand also when it binds equally, so 5 - (3 - 1) and
+        8 / (4 * 2) keep their grouping.
+        """
+        return self._emit(self._infix_parts)
+
+    def to_words(self) -> str:
+        """
+        English words, e.g. "the product of 4 and the sum of 2 and 3". Every
+        operator comes before its two operands, so no grouping is needed and
+        from_words() reads it back.
+        """
+        return self._emit(self._words_parts)
+
+    def render_all(self) -> Dict[str, str]:
+        return {'lisp': self.to_lisp(), 'code': self.to_code(), 'infix': self.to_infix()}
+
+    def _emit(self, parts_of) -> str:
+        out = []
+        stack = [self.root]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                out.append(item)
+            else:
+                stack.extend(reversed(parts_of(item)))
+        return ''.join(out)
+
+    def _lisp_parts(self, row: int) -> list:
+        op = self.ops[row]
+        if op == NUM:
+            return [f"(number {self.values[row]})"]
+        if op == VAR:
+            return [self.values[row]]
+        return [f"({_LISP_NAMES[op]} ", self.left[row], " ", self.right[row], ")"]
+
+    def _code_parts(self, row: int) -> list:
+        op = self.ops[row]
+        if op == NUM:
+            return [f"Number({self.values[row]})"]
+        if op == VAR:
+            return [f"Var('{self.values[row]}')"]
+        return [f"{_CODE_NAMES[op]}(", self.left[row], ", ", self.right[row], ")"]
+
+    def _words_parts(self, row: int) -> list:
+        op = self.ops[row]
+        if op == NUM or op == VAR:
+            return [str(self.values[row])]
+        return [f"{_WORDS[op]} ", self.left[row], " and ", self.right[row]]
+
+    def _infix_parts(self, row: int) -> list:
+        op = self.ops[row]
+        if op == NUM or op == VAR:
+            return [str(self.values[row])]
+        precedence = _PRECEDENCE[op]
+        left, right = self.left[row], self.right[row]
+        parts = []
+        if _PRECEDENCE[self.ops[left]] < precedence:
+            parts += ["(", left, ")"]
+        else:
+            parts.append(left)
+        parts.append(f" {_SYMBOLS[op]} ")
+        if _PRECEDENCE[self.ops[right]] <= precedence:
+            parts += ["(", right, ")"]
+        else:
+            parts.append(right)
+        return parts
+
+def _number(token: str):
+    return float(token) if '.' in token else int(token)
+
+def lisp_to_infix(program) -> str:
+    return ExprIR.from_lisp(program).to_infix()
+
+def infix_to_lisp(text: str) -> str:
+    return ExprIR.from_infix(text).to_lisp()
+
+def expr_to_lisp(expr: Expr) -> str:
+    return ExprIR.from_expr(expr).to_lisp()
+
+def lisp_to_expr(program) -> Expr:
+    return ExprIR.from_lisp(program).to_expr()
@@ -1,118 +1,484 @@
 # https://norvig.com/lispy.html
 
-from typing import Union, List as PyList
+from typing import NamedTuple, Optional, Union, List as PyList
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import math
 import operator as op
+import os
+import pickle
+import re
+import sys
+import threading
 
 Symbol = str              # A Scheme Symbol is implemented as a Python str
 Number = Union[int, float]
 Atom = Union[Symbol, Number]
 List = PyList
 Exp = Union[Atom, "List"]  # Using string for forward reference
-Env = dict             # A Scheme environment (defined below) 
                         
+_TOKEN = re.compile(r'[()]|[^\s()]+')
+_TOKEN_OR_NEWLINE = re.compile(r'[()]|[^\s()]+|\n')
+
 def tokenize(chars: str) -> list:
     "Convert a string of characters into a list of tokens."
-    return chars.replace('(', ' ( ').replace(')', ' ) ').split()
+    return _TOKEN.findall(chars)
+
+def tokenize_with_spans(chars: str) -> tuple:
+    "Tokenize, also returning the (line, column) where each token starts, both 1-based."
+    tokens, spans = [], []
+    line, line_start = 1, 0
+    for match in _TOKEN_OR_NEWLINE.finditer(chars):
+        token = match.group()
+        if token == '\n':
+            line += 1
+            line_start = match.end()
+        else:
+            tokens.append(token)
+            spans.append((line, match.start() - line_start + 1))
+    return tokens, spans
 
 def parse(program: str) -> Exp:
     "Read a Scheme expression from a string."
-    return read_from_tokens(tokenize(program))
+    tokens = tokenize(program)
+    try:
+        return _read(tokens, 0)[0]
+    except SyntaxError as e:
+        # Errors are rare, so only work out token positions when there is one to report
+        _, spans = tokenize_with_spans(program)
+        line, col = spans[e.token_index] if e.token_index < len(spans) else _end_position(program)
+        raise SyntaxError(f"{e.msg} at line {line}, column {col}") from None
 
-def read_from_tokens(tokens: list) -> Exp:
-    "Read an expression from a sequence of tokens."
-    if len(tokens) == 0:
-        raise SyntaxError('unexpected EOF')
-    token = tokens.pop(0)
-    if token == '(':
-        L = []
-        while tokens[0] != ')':
-            L.append(read_from_tokens(tokens))
-        tokens.pop(0) # pop off ')'
-        return L
-    elif token == ')':
-        raise SyntaxError('unexpected )')
+_BYTE_TOKEN = re.compile(rb'[()]|[^\s()]+')
+
+def iter_parse(source, offsets: bool = False, chunk_size: int = 1 << 20):
+    """
+    Read a stream of top-level Scheme expressions, yielding each one as soon as it closes.
+
+    source can be a path, a binary (or text) file object, an mmap, or bytes. The
+    input is scanned chunk by chunk, and only the bytes of the expression
+    currently being read are kept, so memory stays bounded by the largest single
+    expression rather than the whole file.
+
+    With offsets=True, yields (start, end, expression) where start and end are
+    byte offsets of the expression in the source, e.g. for building an index.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield from iter_parse(f, offsets, chunk_size)
+        return
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = memoryview(source)
+        read = _slice_reader(data)
     else:
-        return atom(token)
+        read = source.read
+
+    pending = []       # pieces of an expression that spans several chunks
+    carry = b''        # a token cut off at the end of the previous chunk
+    depth = 0
+    start = None       # byte offset where the current expression began
+    base = 0           # byte offset of data[0]
+    while True:
+        chunk = read(chunk_size)
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        at_eof = not chunk
+        data = carry + chunk
+        carry = b''
+        seg_start = 0  # where the current expression's bytes begin within data
+        limit = len(data)
+        for match in _BYTE_TOKEN.finditer(data):
+            token = match.group()
+            if match.end() == len(data) and not at_eof and token not in (b'(', b')'):
+                # The token may continue in the next chunk
+                carry = token
+                limit = match.start()
+                break
+            if token == b'(':
+                if depth == 0:
+                    start = base + match.start()
+                    seg_start = match.start()
+                depth += 1
+            elif token == b')':
+                if depth == 0:
+                    raise SyntaxError(f"unexpected ) at byte {base + match.start()}")
+                depth -= 1
+                if depth == 0:
+                    pending.append(data[seg_start:match.end()])
+                    x = parse(b''.join(pending).decode('utf-8'))
+                    pending = []
+                    yield (start, base + match.end(), x) if offsets else x
+            elif depth == 0:
+                x = atom(token.decode('utf-8'))
+                yield (base + match.start(), base + match.end(), x) if offsets else x
+        if depth > 0:
+            pending.append(data[seg_start:limit])
+        if at_eof:
+            if depth > 0:
+                raise SyntaxError(f"unexpected EOF in expression starting at byte {start}")
+            return
+        base += limit
+
+def _slice_reader(data: memoryview):
+    position = 0
+    def read(size: int) -> bytes:
+        nonlocal position
+        chunk = data[position:position + size].tobytes()
+        position += len(chunk)
+        return chunk
+    return read
+
+def _end_position(program: str) -> tuple:
+    return program.count('\n') + 1, len(program) - (program.rfind('\n') + 1) + 1
+
+def read_from_tokens(tokens: list) -> Exp:
+    "Read an expression from a sequence of tokens, removing the tokens it used."
+    x, end = _read(tokens, 0)
+    del tokens[:end]
+    return x
+
+def _syntax_error(msg: str, token_index: int) -> SyntaxError:
+    error = SyntaxError(msg)
+    error.token_index = token_index
+    return error
+
+def _read(tokens: list, start: int) -> tuple:
+    """
+    Read one expression starting at tokens[start]; returns (expression, index after it).
+
+    Uses an explicit stack of open lists, so reading is linear in the number of
+    tokens and any nesting depth works. SyntaxErrors carry the offending token
+    index as token_index.
+    """
+    stack = []
+    i, n = start, len(tokens)
+    while True:
+        if i >= n:
+            raise _syntax_error('unexpected EOF', i)
+        token = tokens[i]
+        i += 1
+        if token == '(':
+            stack.append([])
+            continue
+        elif token == ')':
+            if not stack:
+                raise _syntax_error('unexpected )', i - 1)
+            x = stack.pop()
+        else:
+            x = atom(token)
+        if not stack:
+            return x, i
+        stack[-1].append(x)
 
 def atom(token: str) -> Atom:
-    "Numbers become numbers; every other token is a symbol."
+    "Numbers become numbers; every other token is an (interned) symbol."
     try: return int(token)
     except ValueError:
         try: return float(token)
         except ValueError:
-            return Symbol(token)
+            return sys.intern(Symbol(token))
+
+class Env(dict):
+    """
+    An environment: a dict of {'var': val} pairs, with an outer Env.
+
+    version counts the assignments made after the Env was created (define,
+    env[var] = val, update), so code compiled against it can tell when a
+    binding it resolved ahead of time may have changed.
+    """
+    version = 0
+
+    def __init__(self, parms=(), args=(), outer=None):
+        if isinstance(parms, Symbol):   # (lambda args body) collects every argument
+            dict.__setitem__(self, parms, list(args))
+        else:
+            if len(args) != len(parms):
+                raise TypeError(f"expected {len(parms)} arguments, got {len(args)}")
+            dict.update(self, zip(parms, args))
+        self.outer = outer
+
+    def __setitem__(self, var: Symbol, val):
+        dict.__setitem__(self, var, val)
+        self.version += 1
+
+    def __delitem__(self, var: Symbol):
+        dict.__delitem__(self, var)
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
+
+    def find(self, var: Symbol) -> "Env":
+        "Find the innermost Env where var appears."
+        env = self
+        while var not in env:
+            env = env.outer
+            if env is None:
+                raise LookupError(var)
+        return env
+
+def env_versions(env: Env) -> tuple:
+    "The versions of env and every Env outside it; equal tuples mean no binding visible from env changed."
+    versions = []
+    while env is not None:
+        versions.append(env.version)
+        env = env.outer
+    return tuple(versions)
+
+class Procedure:
+    "A user-defined Scheme procedure."
+    def __init__(self, parms, body: Exp, env: Env):
+        self.parms, self.body, self.env = parms, body, env
+
+    def __call__(self, *args):
+        return eval(self.body, Env(self.parms, args, self.env))
+
+def number(x):
+    "Simply returns the number."
+    return x
 
 def standard_env() -> Env:
     "An environment with some Scheme standard procedures."
     env = Env()
     env.update({
-        'number': lambda x: x,  # Simply returns the number
+        'number': number,
         'add': op.add,
         'sub': op.sub,
         'mul': op.mul,
         'div': op.truediv,
+        '<': op.lt, '>': op.gt, '=': op.eq, '<=': op.le, '>=': op.ge,
     })
     return env
 
 global_env = standard_env()
 
+SPECIAL_FORMS = ('if', 'define', 'lambda', 'let', 'begin')
+
+def _body(forms: list) -> Exp:
+    "A body of one or more expressions as a single expression."
+    return forms[0] if len(forms) == 1 else ['begin', *forms]
+
 def eval(x: Exp, env=global_env) -> Exp:
-    "Evaluate an expression in an environment."
-    if isinstance(x, Symbol):      # variable reference
-        return env[x]
-    elif isinstance(x, Number):    # constant number
-        return x                
-    else:                         # procedure call
-        proc = eval(x[0], env)
-        args = [eval(arg, env) for arg in x[1:]]
-        return proc(*args)
+    """
+    Evaluate an expression in an environment.
+
+    Expressions in tail position (the branches of an if, the last expression of
+    a body, and the body of a called procedure) are evaluated by looping rather
+    than recursing, so tail calls run in constant Python stack space.
+    """
+    while True:
+        if isinstance(x, Symbol):      # variable reference
+            return env.find(x)[x]
+        elif isinstance(x, Number):    # constant number
+            return x
+        head = x[0] if x else None
+        if head == 'if':               # (if test conseq alt)
+            (_, test, conseq, alt) = x
+            x = conseq if eval(test, env) else alt
+        elif head == 'define':         # (define var exp)
+            (_, var, exp) = x
+            env[var] = eval(exp, env)
+            return None
+        elif head == 'lambda':         # (lambda (var...) body...)
+            (_, parms, *body) = x
+            return Procedure(parms, _body(body), env)
+        elif head == 'let':            # (let ((var exp)...) body...)
+            (_, bindings, *body) = x
+            env = Env([var for var, _ in bindings], [eval(exp, env) for _, exp in bindings], env)
+            x = _body(body)
+        elif head == 'begin':          # (begin exp... last)
+            for exp in x[1:-1]:
+                eval(exp, env)
+            x = x[-1]
+        else:                          # procedure call
+            proc = eval(head, env)
+            args = [eval(arg, env) for arg in x[1:]]
+            if isinstance(proc, Procedure):
+                x, env = proc.body, Env(proc.parms, args, proc.env)
+            else:
+                return proc(*args)
+
+_NOT_CONSTANT = object()
+
+# Closures for the binary primitives, specialized for constant operands
+_BINARY_OPERATORS = {
+    op.add: (lambda a, b: lambda: a() + b(), lambda a, c: lambda: a() + c, lambda c, b: lambda: c + b()),
+    op.sub: (lambda a, b: lambda: a() - b(), lambda a, c: lambda: a() - c, lambda c, b: lambda: c - b()),
+    op.mul: (lambda a, b: lambda: a() * b(), lambda a, c: lambda: a() * c, lambda c, b: lambda: c * b()),
+    op.truediv: (lambda a, b: lambda: a() / b(), lambda a, c: lambda: a() / c, lambda c, b: lambda: c / b()),
+}
+
+def _constant(value):
+    return (lambda: value), value
+
+def _analyze_call(proc_item, arg_items):
+    "Build the closure for one call from its analyzed operator and operands."
+    proc_fn, proc = proc_item
+    if proc is _NOT_CONSTANT:
+        arg_fns = [fn for fn, _ in arg_items]
+        return (lambda: proc_fn()(*[fn() for fn in arg_fns])), _NOT_CONSTANT
+
+    values = [value for _, value in arg_items]
+    if _NOT_CONSTANT not in values and not isinstance(proc, Procedure):
+        # Every operand is known: fold the call now unless it fails, then fail at run time instead
+        try:
+            return _constant(proc(*values))
+        except Exception:
+            pass
+
+    if len(arg_items) == 2 and proc in _BINARY_OPERATORS:
+        both, right_const, left_const = _BINARY_OPERATORS[proc]
+        (a, a_value), (b, b_value) = arg_items
+        if b_value is not _NOT_CONSTANT:
+            return right_const(a, b_value), _NOT_CONSTANT
+        if a_value is not _NOT_CONSTANT:
+            return left_const(a_value, b), _NOT_CONSTANT
+        return both(a, b), _NOT_CONSTANT
+    if len(arg_items) == 1:
+        (a, _), = arg_items
+        return (lambda: proc(a())), _NOT_CONSTANT
+    arg_fns = [fn for fn, _ in arg_items]
+    return (lambda: proc(*[fn() for fn in arg_fns])), _NOT_CONSTANT
+
+def analyze(x: Exp, env=global_env):
+    """
+    Analyze an expression once into a Python closure that evaluates it.
+
+    Symbols are looked up while analyzing, constant sub-expressions such as
+    (number 5) or (add (number 1) (number 2)) are folded, and calls to the
+    binary primitives become specialized closures. Calling the result only runs
+    the closures, with no type dispatch or environment lookups. Special forms
+    (if, define, lambda, let, begin) are left to eval().
+
+    The closure keeps the bindings env had when it was analyzed; use
+    compile_program() to get one that follows later defines.
+    """
+    results = []
+    stack = [(x, False)]
+    while stack:
+        item, children_done = stack.pop()
+        if isinstance(item, Symbol):
+            try:
+                results.append(_constant(env.find(item)[item]))
+            except LookupError:
+                # Not bound yet: look it up when run, failing the same way eval() would
+                results.append(((lambda name=item: env.find(name)[name]), _NOT_CONSTANT))
+        elif isinstance(item, Number):
+            results.append(_constant(item))
+        elif item and item[0] in SPECIAL_FORMS:
+            # Special forms bind names at run time, so hand them to the interpreter
+            results.append(((lambda item=item: eval(item, env)), _NOT_CONSTANT))
+        elif not children_done:
+            stack.append((item, True))
+            stack.extend((part, False) for part in reversed(item))
+        else:
+            parts = results[len(results) - len(item):]
+            del results[len(results) - len(item):]
+            results.append(_analyze_call(parts[0], parts[1:]))
+    return results[0][0]
+
+_compiled_programs = {}
+_compiled_programs_lock = threading.Lock()
+_MAX_COMPILED_PROGRAMS = 4096
+
+def compile_program(program: str, env=global_env):
+    """
+    Parse and analyze a program, reusing the closure when the same source was
+    compiled before and no binding visible from env has been assigned since.
+    """
+    key = (program, id(env))
+    versions = env_versions(env)
+    with _compiled_programs_lock:
+        cached = _compiled_programs.get(key)
+    if cached is not None and cached[0] is env and cached[1] == versions:
+        return cached[2]
+    proc = analyze(parse(program), env)
+    with _compiled_programs_lock:
+        if key not in _compiled_programs and len(_compiled_programs) >= _MAX_COMPILED_PROGRAMS:
+            del _compiled_programs[next(iter(_compiled_programs))]  # drop the oldest
+        _compiled_programs[key] = (env, versions, proc)
+    return proc
+
+class EvalResult(NamedTuple):
+    value: Exp = None
+    error: Optional[Exception] = None   # what evaluating the program raised, if anything
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+def free_threaded() -> bool:
+    "True on a CPython build running without the GIL."
+    return not getattr(sys, '_is_gil_enabled', lambda: True)()
+
+def _eval_isolated(program, env_factory) -> EvalResult:
+    "Evaluate one program (text or parsed) in a fresh environment, capturing any error."
+    try:
+        x = parse(program) if isinstance(program, str) else program
+        return EvalResult(eval(x, env_factory()))
+    except Exception as e:
+        return EvalResult(error=e)
+
+def _eval_chunk(programs: list, env_factory=standard_env) -> list:
+    return [_eval_isolated(program, env_factory) for program in programs]
+
+def _eval_chunk_in_process(programs: list, env_factory=standard_env) -> list:
+    "Like _eval_chunk, but turns values that can't be sent back to the parent into errors."
+    results = _eval_chunk(programs, env_factory)
+    for i, result in enumerate(results):
+        if result.ok and not isinstance(result.value, (int, float, str, type(None))):
+            try:
+                pickle.dumps(result.value)
+            except Exception as e:
+                results[i] = EvalResult(error=TypeError(f"result can't leave the worker process: {e}"))
+    return results
+
+def eval_many(programs, workers: Optional[int] = None, env_factory=standard_env) -> PyList[EvalResult]:
+    """
+    Evaluate many programs concurrently, each in its own environment.
+
+    Every program runs in a fresh env_factory() environment, so a define in one
+    never leaks into another or into global_env. Work is split into chunks and
+    spread over a thread pool on free-threaded CPython, where threads run in
+    parallel, and over a process pool otherwise (env_factory must then be
+    picklable, e.g. a module-level function).
+
+    Args:
+        programs: Program texts or parsed expressions
+        workers (int, optional): Pool size; defaults to every usable core,
+            and 1 evaluates in the calling thread
+        env_factory: Builds the environment for each program
+
+    Returns:
+        list[EvalResult]: One result per program, in order. Errors are captured
+            in EvalResult.error rather than raised.
+    """
+    programs = list(programs)
+    if workers is None:
+        workers = getattr(os, 'process_cpu_count', os.cpu_count)() or 1
+    if workers <= 1 or len(programs) <= 1:
+        return _eval_chunk(programs, env_factory)
+
+    size = -(-len(programs) // (workers * 4))  # a few chunks per worker to even out the load
+    chunks = [programs[i:i + size] for i in range(0, len(programs), size)]
+    if free_threaded():
+        pool, work = ThreadPoolExecutor(workers), _eval_chunk
+    else:
+        pool, work = ProcessPoolExecutor(workers), _eval_chunk_in_process
+    with pool:
+        return [result for chunk in pool.map(work, chunks, [env_factory] * len(chunks))
+                for result in chunk]
 
 def convert_to_infix(expr_str: str) -> str:
-    """Convert a Lisp expression to infix notation"""
-    expr = parse(expr_str)
-    
-    def _convert(x: Exp, is_outer: bool = True) -> str:
-        if isinstance(x, Number):
-            return str(x)
-        
-        # For procedure calls
-        if len(x) > 0:
-            op = x[0]
-            op_map = {
-                'add': '+',
-                'sub': '-',
-                'mul': '*', 
-                'div': '/'
-            }
-            
-            if op == 'number':
-                return str(x[1])
-                
-            if op in op_map:
-                left = _convert(x[1], False)
-                right = _convert(x[2], False)
-                op_symbol = op_map[op]
-                
-                # For mul/div, wrap operands if they are add/sub expressions
-                if op in ['mul', 'div']:
-                    # Check if left operand is an add/sub expression
-                    if isinstance(x[1], list) and x[1][0] in ['add', 'sub']:
-                        left = f"({left})"
-                    # Check if right operand is an add/sub expression
-                    if isinstance(x[2], list) and x[2][0] in ['add', 'sub']:
-                        right = f"({right})"
-                    result = f"{left} {op_symbol} {right}"
-                else:
-                    # For add/sub, no need to wrap operands
-                    result = f"{left} {op_symbol} {right}"
-                
-                return result
-                
-        return str(x)
-        
-    return _convert(expr)
+    """
+    Convert a Lisp expression to infix notation.
+
+    Uses only the parentheses the tree needs, including on the right of - and /,
+    so (sub 5 (sub 3 1)) becomes 5 - (3 - 1).
+    """
+    from ir import ExprIR  # ir imports this module
+    return ExprIR.from_lisp(expr_str).to_infix()
 
 def test_infix_conversion():
     """Test the infix notation converter with various expressions"""
@@ -132,7 +498,13 @@ def test_infix_conversion():
         
         # Complex nested expressions
         ("(add (mul (sub (number 10) (number 5)) (number 2)) (div (number 20) (number 4)))", 
-         "(10 - 5) * 2 + 20 / 4")
+         "(10 - 5) * 2 + 20 / 4"),
+
+        # Associativity tests
+        ("(sub (number 5) (sub (number 3) (number 1)))", "5 - (3 - 1)"),
+        ("(sub (sub (number 5) (number 3)) (number 1))", "5 - 3 - 1"),
+        ("(div (number 8) (mul (number 4) (number 2)))", "8 / (4 * 2)"),
+        ("(add (number 1) (add (number 2) (number 3)))", "1 + (2 + 3)")
     ]
 
     passed = 0
@@ -203,9 +575,80 @@ def test_lisp_eval():
     print(f"Failed: {failed}")
     print(f"Total: {passed + failed}")
 
+def test_special_forms():
+    """Test define, lambda, let, if and tail calls in a fresh environment"""
+    test_cases = [
+        ("(let ((x (number 2)) (y (number 3))) (mul x y))", 6),
+        ("((lambda (x y) (sub x y)) (number 10) (number 4))", 6),
+        ("(if (< (number 1) (number 2)) (number 10) (number 20))", 10),
+        ("(begin (define sq (lambda (x) (mul x x))) (sq (number 7)))", 49),
+        ("(begin (define fact (lambda (n acc) (if (= n 0) acc (fact (sub n 1) (mul n acc))))) (fact 10 1))", 3628800),
+        # Deep tail recursion must not grow the Python stack
+        ("(begin (define count (lambda (n) (if (= n 0) (number 0) (count (sub n 1))))) (count 100000))", 0),
+        ("(let ((add1 (lambda (x) (add x 1)))) (let ((x 41)) (add1 x)))", 42),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for expr_str, expected in test_cases:
+        try:
+            result = eval(parse(expr_str), Env(outer=standard_env()))
+            if result == expected:
+                print(f"PASS: {expr_str} = {result}")
+                passed += 1
+            else:
+                print(f"FAIL: {expr_str}, expected {expected}, got {result}")
+                failed += 1
+
+        except Exception as e:
+            print(f"ERROR: {expr_str} raised {str(e)}")
+            failed += 1
+
+    print(f"\nTest Summary:")
+    print(f"Passed: {passed}")
+    print(f"Failed: {failed}")
+    print(f"Total: {passed + failed}")
+
+def test_redefinition():
+    """Test that compiled programs see a symbol redefined between calls, as eval() does"""
+    env = Env(outer=standard_env())
+    test_cases = [
+        ("(define x (number 1))", "(add x (number 1))", 2),
+        ("(define x (number 2))", "(add x (number 1))", 3),
+        ("(define add sub)", "(add x (number 1))", 1),
+        ("(define f (lambda (n) (mul n n)))", "(f x)", 4),
+        ("(define f (lambda (n) (add n n)))", "(f x)", 0),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for definition, expr_str, expected in test_cases:
+        try:
+            eval(parse(definition), env)
+            result = compile_program(expr_str, env)()
+            if result == expected == eval(parse(expr_str), env):
+                print(f"PASS: {definition} then {expr_str} = {result}")
+                passed += 1
+            else:
+                print(f"FAIL: {definition} then {expr_str}, expected {expected}, got {result}")
+                failed += 1
+
+        except Exception as e:
+            print(f"ERROR: {definition} then {expr_str} raised {str(e)}")
+            failed += 1
+
+    print(f"\nTest Summary:")
+    print(f"Passed: {passed}")
+    print(f"Failed: {failed}")
+    print(f"Total: {passed + failed}")
+
 
 if __name__ == "__main__":
     test_infix_conversion()
     test_lisp_eval()
+    test_special_forms()
+    test_redefinition()
 
     
\ No newline at end of file
@@ -1,130 +1,77 @@
-from openai import OpenAI
+from api_client import get_async_client, get_client
 import random
-from lisp_ast import tokenize, read_from_tokens, eval, convert_to_infix, parse
-from datetime import datetime, timedelta
+from harness import GradeTotals, complete_all, grade_lisp, grade_responses
+from generators import generate_expression
 
 # Set random seed for reproducibility
 random.seed(42)
 
-def read_api_key(filename="../api/openaikey.txt"):
-    try:
-        with open(filename, 'r') as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Please create a {filename} file with your OpenAI API key")
-    except Exception as e:
-        raise Exception(f"Error reading API key: {e}")
+# Setup OpenAI client; repeated requests are answered from the on-disk response cache
+client = get_client()
 
-# Setup OpenAI client
-api_key = read_api_key()
-client = OpenAI(api_key=api_key)
+PROMPT_FILE = "prompts/lisp_gpt_prompt.txt"
 
 def generate_random_lisp_expression(max_depth=4) -> str:
     """
     Generates a random Lisp expression string with a maximum depth.
     """
-    if max_depth <= 1:
-        return f"(number {random.randint(1, 10)})"
-    
-    operators = ['add', 'sub', 'mul', 'div']
-    op = random.choice(operators)
-    
-    left = generate_random_lisp_expression(max_depth - 1)
-    right = generate_random_lisp_expression(max_depth - 1)
-    
-    # For division, ensure we don't divide by zero
-    if op == 'div':
-        try:
-            right_val = eval(parse(right))
-            if right_val == 0:
-                right = f"(number {random.randint(1, 10)})"
-        except:
-            right = f"(number {random.randint(1, 10)})"
-            
-    return f"({op} {left} {right})"
+    return generate_expression(max_depth, true_division=True).lisp
 
-def test_gpt_expression_conversion(num_tests: int, depth: int, model: str = "gpt-3.5-turbo") -> tuple[float, float, int, int]:
+def test_gpt_expression_conversion(num_tests: int, depth: int, model: str = "gpt-3.5-turbo", cases=None) -> tuple[float, float, int, int]:
     """
     Tests GPT's ability to convert random Lisp expressions of given depth.
     
+    If cases (e.g. from corpus.Corpus.cases with true_division=True) is given,
+    its first num_tests expressions are used instead of new random ones.
+    
     Returns:
         tuple[float, float, int, int]: (value_match_rate, code_match_rate, total_tokens, total_evaluable)
     """
-    system_message = open("prompts/lisp_gpt_prompt.txt").read()
-
-    value_matches = 0
-    code_matches = 0
-    total_evaluable = 0
-    total_parseable = 0
-    total_tokens = 0
+    system_message = open(PROMPT_FILE).read()
+    totals = GradeTotals()
 
     for i in range(num_tests):
-        lisp_expr = generate_random_lisp_expression(depth)
-        infix_expr = convert_to_infix(lisp_expr)
+        generated = cases[i] if cases is not None else generate_expression(depth, true_division=True)
         print(f"\nTest {i+1}/{num_tests}")
-        print(f"Original Lisp: {lisp_expr}")
-        print(f"Infix expression: {infix_expr}")
+        print(describe_case(generated))
         
         try:
             response = client.chat.completions.create(
                 model=model,
                 messages=[
                     {"role": "system", "content": system_message},
-                    {"role": "user", "content": infix_expr}
+                    {"role": "user", "content": generated.lisp_infix}
                 ],
                 temperature=0.0
             )
             
-            total_tokens += response.usage.prompt_tokens + response.usage.completion_tokens
-            generated_expr = response.choices[0].message.content.strip()
-            print(f"Generated Lisp: {generated_expr}")
-            
-            # Always attempt string matching
-            total_parseable += 1
-            if generated_expr == lisp_expr:
-                code_matches += 1
-                print("String representation match!")
-            else:
-                print("String representation mismatch!")
-                print(f"Original Lisp: {lisp_expr}")
-                print(f"Generated Lisp: {generated_expr}")
-            
-            try:
-                # Try to parse and evaluate both expressions
-                original_result = eval(parse(lisp_expr))
-                generated_result = eval(parse(generated_expr))
-                
-                total_evaluable += 1
-                
-                if original_result == generated_result:
-                    value_matches += 1
-                    print(f"Evaluation match: both = {original_result}")
-                else:
-                    print(f"Evaluation mismatch!")
-                    print(f"Original evaluates to: {original_result}")
-                    print(f"Generated evaluates to: {generated_result}")
-                    
-            except ZeroDivisionError:
-                print("Evaluation skipped: Division by zero")
-            except Exception as e:
-                print(f"Error in parsing or evaluation: {str(e)}")
+            totals.add_usage(response)
+            grade_lisp(generated, response.choices[0].message.content.strip(), totals)
                 
         except Exception as e:
             print(f"API or other error: {str(e)}")
     
-    # Calculate success rates
-    value_success_rate = value_matches / total_evaluable if total_evaluable > 0 else 0.0
-    code_success_rate = code_matches / total_parseable if total_parseable > 0 else 0.0
-    
-    print(f"\nOverall Results:")
-    print(f"Total tests: {num_tests}")
-    print(f"Successfully parsed: {total_parseable}")
-    print(f"Successfully evaluated: {total_evaluable}")
-    print(f"Value match success rate: {value_success_rate:.2%}")
-    print(f"Code match success rate: {code_success_rate:.2%}")
-    print(f"Total tokens used: {total_tokens}")
-    
-    return value_success_rate, code_success_rate, total_tokens, total_evaluable
+    return totals.report(num_tests)
+
+async def test_gpt_expression_conversion_async(num_tests: int, depth: int, model: str = "gpt-3.5-turbo",
+                                               cases=None, concurrency: int = 8) -> tuple[float, float, int, int]:
+    """
+    Like test_gpt_expression_conversion, but with up to concurrency requests in flight at once.
+
+    Every request is sent first; the answers are then graded and printed in
+    test order, and aggregated into the same tuple of rates and tokens.
+    """
+    system_message = open(PROMPT_FILE).read()
+    cases = [cases[i] if cases is not None else generate_expression(depth, true_division=True)
+             for i in range(num_tests)]
+    # A client per run: its connection pool belongs to this run's event loop
+    async with get_async_client() as async_client:
+        responses = await complete_all(async_client, model, system_message,
+                                       [generated.lisp_infix for generated in cases], concurrency)
+    return grade_responses(cases, responses, grade_lisp, describe_case)
+
+def describe_case(generated) -> str:
+    return f"Original Lisp: {generated.lisp}\nInfix expression: {generated.lisp_infix}"
 
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
@@ -0,0 +1,216 @@
+import hashlib
+import operator as op
+import threading
+from array import array
+from lisp_ast import Symbol, Number, Exp, Env, SPECIAL_FORMS, env_versions, global_env, number, parse
+import lisp_ast
+
+# Every instruction is two slots in the code array: opcode, argument
+CONST, LOAD, CALL, EVAL, ADD, SUB, MUL, DIV = range(8)
+
+OPCODE_NAMES = ('CONST', 'LOAD', 'CALL', 'EVAL', 'ADD', 'SUB', 'MUL', 'DIV')
+
+# Primitives with an opcode of their own, when a call's operator is bound to them
+_BINARY_OPCODES = {op.add: ADD, op.sub: SUB, op.mul: MUL, op.truediv: DIV}
+
+_UNBOUND = object()
+
+class Bytecode:
+    """
+    A compiled program: a flat array of (opcode, argument) pairs, the constant
+    pool the arguments index into, and the environment it was compiled against.
+
+        CONST i   push constants[i]
+        LOAD i    push the value bound to the symbol constants[i], looked up when run
+        CALL n    pop n arguments and a procedure, push the result of the call
+        EVAL i    push lisp_ast.eval(constants[i]) (special forms)
+        ADD, SUB, MUL, DIV   pop two operands, push the result
+    """
+
+    __slots__ = ('code', 'constants', 'env')
+
+    def __init__(self, code: array, constants: list, env: Env):
+        self.code = code
+        self.constants = constants
+        self.env = env
+
+    def __len__(self) -> int:
+        return len(self.code) // 2
+
+    def disassemble(self) -> str:
+        lines = []
+        for pc in range(0, len(self.code), 2):
+            opcode, arg = self.code[pc], self.code[pc + 1]
+            if opcode in (CONST, LOAD, EVAL):
+                lines.append(f"{pc // 2:4d} {OPCODE_NAMES[opcode]:<6} {arg} ({self.constants[arg]!r})")
+            elif opcode == CALL:
+                lines.append(f"{pc // 2:4d} CALL   {arg}")
+            else:
+                lines.append(f"{pc // 2:4d} {OPCODE_NAMES[opcode]}")
+        return '\n'.join(lines)
+
+def _lookup(symbol, env: Env):
+    try:
+        return env.find(symbol)[symbol]
+    except LookupError:
+        return _UNBOUND
+
+def compile_bytecode(x: Exp, env=global_env) -> Bytecode:
+    """
+    Compile a parsed expression into bytecode for run().
+
+    Like analyze(), symbols bound when compiling are resolved once and stored
+    as constants, and calls whose operator is the add/sub/mul/div primitive get
+    their own opcode; (number n) becomes a constant. Unbound symbols are looked
+    up when the code runs, and special forms are handed to eval().
+    """
+    code = array('q')
+    constants = []
+    constant_index = {}
+
+    def constant(value) -> int:
+        key = (type(value), value)
+        try:
+            return constant_index[key]
+        except KeyError:
+            constants.append(value)
+            constant_index[key] = len(constants) - 1
+            return len(constants) - 1
+        except TypeError:  # unhashable, e.g. a quoted list for EVAL
+            constants.append(value)
+            return len(constants) - 1
+
+    stack = [(x, None)]
+    while stack:
+        item, instruction = stack.pop()
+        if instruction is not None:
+            code.extend(instruction)
+        elif isinstance(item, Symbol):
+            value = _lookup(item, env)
+            if value is _UNBOUND:
+                code.extend((LOAD, constant(item)))
+            else:
+                code.extend((CONST, constant(value)))
+        elif isinstance(item, Number):
+            code.extend((CONST, constant(item)))
+        elif not item or item[0] in SPECIAL_FORMS:
+            code.extend((EVAL, constant(item)))
+        else:
+            head, args = item[0], item[1:]
+            proc = _lookup(head, env) if isinstance(head, Symbol) else _UNBOUND
+            if proc is number and len(args) == 1 and isinstance(args[0], Number):
+                code.extend((CONST, constant(number(args[0]))))
+                continue
+            opcode = _BINARY_OPCODES.get(proc) if callable(proc) and len(args) == 2 else None
+            if opcode is not None:
+                stack.append((None, (opcode, 0)))
+                stack.extend((arg, None) for arg in reversed(args))
+            else:
+                stack.append((None, (CALL, len(args))))
+                stack.extend((arg, None) for arg in reversed(args))
+                stack.append((head, None))
+    return Bytecode(code, constants, env)
+
+def run(bytecode: Bytecode) -> Exp:
+    "Execute compiled bytecode in the environment it was compiled against."
+    code, constants, env = bytecode.code, bytecode.constants, bytecode.env
+    stack = []
+    push, pop = stack.append, stack.pop
+    pc, end = 0, len(code)
+    while pc < end:
+        opcode, arg = code[pc], code[pc + 1]
+        pc += 2
+        if opcode == CONST:
+            push(constants[arg])
+        elif opcode == ADD:
+            b = pop()
+            stack[-1] = stack[-1] + b
+        elif opcode == SUB:
+            b = pop()
+            stack[-1] = stack[-1] - b
+        elif opcode == MUL:
+            b = pop()
+            stack[-1] = stack[-1] * b
+        elif opcode == DIV:
+            b = pop()
+            stack[-1] = stack[-1] / b
+        elif opcode == CALL:
+            start = len(stack) - arg
+            args = stack[start:]
+            del stack[start:]
+            stack[-1] = stack[-1](*args)
+        elif opcode == LOAD:
+            name = constants[arg]
+            push(env.find(name)[name])
+        elif opcode == EVAL:
+            push(lisp_ast.eval(constants[arg], env))
+        else:
+            raise ValueError(f"Bad opcode {opcode} at {pc - 2}")
+    return stack[-1]
+
+_bytecode_cache = {}
+_bytecode_cache_lock = threading.Lock()
+_MAX_CACHED_PROGRAMS = 4096
+
+def _source_key(program: str) -> bytes:
+    return hashlib.blake2b(program.encode('utf-8'), digest_size=16).digest()
+
+def compile_source(program: str, env=global_env) -> Bytecode:
+    """
+    Parse and compile a program, reusing the bytecode when the same source was
+    compiled before and no binding visible from env has been assigned since
+    (compiled code holds the values symbols had when it was compiled).
+    """
+    key = (_source_key(program), id(env))
+    versions = env_versions(env)
+    with _bytecode_cache_lock:
+        cached = _bytecode_cache.get(key)
+    if cached is not None and cached[1].env is env and cached[0] == versions:
+        return cached[1]
+    bytecode = compile_bytecode(parse(program), env)
+    with _bytecode_cache_lock:
+        if key not in _bytecode_cache and len(_bytecode_cache) >= _MAX_CACHED_PROGRAMS:
+            del _bytecode_cache[next(iter(_bytecode_cache))]  # drop the oldest
+        _bytecode_cache[key] = (versions, bytecode)
+    return bytecode
+
+def eval_source(program: str, env=global_env) -> Exp:
+    "Evaluate program text on the VM; the same result as eval(parse(program), env)."
+    return run(compile_source(program, env))
+
+def test_redefinition():
+    """Test that eval_source sees a symbol redefined between calls, as eval() does"""
+    env = Env(outer=lisp_ast.standard_env())
+    test_cases = [
+        ("(define x (number 1))", "(add x (number 1))", 2),
+        ("(define x (number 2))", "(add x (number 1))", 3),
+        ("(define add sub)", "(add x (number 1))", 1),
+        ("(define f (lambda (n) (mul n n)))", "(f x)", 4),
+        ("(define f (lambda (n) (add n n)))", "(f x)", 0),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for definition, expr_str, expected in test_cases:
+        try:
+            eval_source(definition, env)
+            result = eval_source(expr_str, env)
+            if result == expected == lisp_ast.eval(parse(expr_str), env):
+                print(f"PASS: {definition} then {expr_str} = {result}")
+                passed += 1
+            else:
+                print(f"FAIL: {definition} then {expr_str}, expected {expected}, got {result}")
+                failed += 1
+
+        except Exception as e:
+            print(f"ERROR: {definition} then {expr_str} raised {str(e)}")
+            failed += 1
+
+    print(f"\nTest Summary:")
+    print(f"Passed: {passed}")
+    print(f"Failed: {failed}")
+    print(f"Total: {passed + failed}")
+
+if __name__ == "__main__":
+    test_redefinition()
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import runpy
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Optional
+from ir import ExprIR, NUM, VAR, ADD, SUB, MUL, DIV
+
+# api_client points every harness at the mock when this is set: "fake" for the
+# in-process FakeClient, or the base URL of a running mock server
+MOCK_API = "MOCK_API"
+
+CORRUPTIONS = ('number', 'operator', 'swap')
+UNPARSEABLE_ANSWER = "I can't convert that expression."
+
+class MockError(Exception):
+    """An error response from the mock: 500 for injected errors, 429 when rate limited."""
+
+    def __init__(self, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"Error code: {status_code} - {message}")
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class MockModel:
+    """
+    A deterministic stand-in for a chat model that knows the harness prompts.
+
+    The user message is parsed as infix (or ExprIR.to_words() words) and
+    answered in Lisp when the system prompt describes (number value), in Expr
+    code otherwise, via ir.ExprIR.
+    With probability corruption the answer has one deliberate mistake: a
+    number off by one, a wrong operator or swapped operands. Whether and how
+    an answer is corrupted depends only on seed and the request, so repeated
+    requests get the same answer.
+
+    Latency, injected 500 errors (error_rate) and a requests-per-second limit
+    answered with 429 (rate_limit) vary per call instead; the error draws come
+    from one generator seeded with seed.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: Optional[float] = None, corruption: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.corruption = corruption
+        self.seed = seed
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._faults = random.Random(seed)
+        self._burst = max(1.0, rate_limit or 0.0)
+        self._tokens = self._burst
+        self._refilled = time.monotonic()
+
+    @classmethod
+    def from_env(cls) -> "MockModel":
+        """Settings from MOCK_LATENCY, MOCK_JITTER, MOCK_ERROR_RATE, MOCK_RATE_LIMIT, MOCK_CORRUPTION and MOCK_SEED."""
+        env = os.environ
+        rate_limit = env.get("MOCK_RATE_LIMIT")
+        return cls(latency=float(env.get("MOCK_LATENCY", 0.0)), jitter=float(env.get("MOCK_JITTER", 0.0)),
+                   error_rate=float(env.get("MOCK_ERROR_RATE", 0.0)),
+                   rate_limit=float(rate_limit) if rate_limit else None,
+                   corruption=float(env.get("MOCK_CORRUPTION", 0.0)), seed=int(env.get("MOCK_SEED", 0)))
+
+    def delay(self) -> float:
+        """Seconds the next response should take."""
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._faults.uniform(0.0, self.jitter)
+
+    def _admit(self):
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self._burst, self._tokens + (now - self._refilled) * self.rate_limit)
+                self._refilled = now
+                if self._tokens < 1.0:
+                    raise MockError(429, "Rate limit reached", retry_after=(1.0 - self._tokens) / self.rate_limit)
+                self._tokens -= 1.0
+            if self.error_rate and self._faults.random() < self.error_rate:
+                raise MockError(500, "The server had an error while processing your request")
+
+    def answer(self, model: str, system_message: str, user_message: str) -> str:
+        """The answer to one request; the same for the same arguments and seed."""
+        digest = hashlib.blake2b(f"{self.seed}\0{model}\0{system_message}\0{user_message}".encode(),
+                                 digest_size=8).digest()
+        rng = random.Random(int.from_bytes(digest, 'little'))
+        try:
+            ir = ExprIR.from_infix(user_message)
+        except SyntaxError:
+            try:
+                ir = ExprIR.from_words(user_message)
+            except SyntaxError:
+                return UNPARSEABLE_ANSWER
+        if self.corruption and rng.random() < self.corruption:
+            corrupt(ir, rng)
+        return ir.to_lisp() if "(number" in system_message else ir.to_code()
+
+    def complete(self, model: str, messages: list) -> dict:
+        """
+        A chat completion as the JSON body the API returns, without waiting out
+        delay(). Raises MockError for injected errors and rate limiting.
+        """
+        self._admit()
+        system_message = "".join(m["content"] for m in messages if m["role"] == "system")
+        user_message = [m["content"] for m in messages if m["role"] == "user"][-1]
+        content = self.answer(model, system_message, user_message)
+        prompt_tokens = sum(_tokens(m["content"]) for m in messages)
+        completion_tokens = _tokens(content)
+        return {
+            "id": f"chatcmpl-mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+def corrupt(ir: ExprIR, rng: random.Random):
+    """Makes one mistake in ir, in place: a number off by one, a different operator or swapped operands."""
+    row = rng.randrange(len(ir))
+    op = ir.ops[row]
+    if op == NUM:
+        ir.values[row] += rng.choice((-1, 1))
+    elif op == VAR:
+        ir.values[row] += "_"
+    elif rng.choice(CORRUPTIONS[1:]) == 'operator':
+        ir.ops[row] = rng.choice([other for other in (ADD, SUB, MUL, DIV) if other != op])
+    else:
+        # Both children still come before the row, so post-order holds
+        ir.left[row], ir.right[row] = ir.right[row], ir.left[row]
+
+def _response(body: dict):
+    choice = body["choices"][0]
+    usage = body["usage"]
+    return SimpleNamespace(
+        id=body["id"], model=body["model"],
+        choices=[SimpleNamespace(index=0, finish_reason=choice["finish_reason"],
+                                 message=SimpleNamespace(**choice["message"]))],
+        usage=SimpleNamespace(**usage))
+
+class FakeClient:
+    """
+    An in-process client with the client.chat.completions.create() the
+    harnesses call, answered by a MockModel. Errors raise MockError and are not
+    retried.
+    """
+
+    def __init__(self, model: Optional[MockModel] = None):
+        self.model = model or MockModel()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model: str, messages: list, **params):
+        time.sleep(self.model.delay())
+        return _response(self.model.complete(model, messages))
+
+class AsyncFakeClient:
+    """The asyncio counterpart of FakeClient, usable as an async context manager like AsyncOpenAI."""
+
+    def __init__(self, model: Optional[MockModel] = None):
+        self.model = model or MockModel()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model: str, messages: list, **params):
+        await asyncio.sleep(self.model.delay())
+        return _response(self.model.complete(model, messages))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Serves POST /v1/chat/completions from the server's MockModel."""
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            model, messages = request["model"], request["messages"]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": {"message": f"Invalid request: {e}", "type": "invalid_request_error"}})
+            return
+        mock = self.server.mock_model
+        time.sleep(mock.delay())
+        try:
+            self._send(200, mock.complete(model, messages))
+        except MockError as e:
+            headers = {}
+            if e.retry_after is not None:
+                headers['Retry-After'] = f"{e.retry_after:.3f}"
+            kind = "rate_limit_exceeded" if e.status_code == 429 else "server_error"
+            self._send(e.status_code, {"error": {"message": e.message, "type": kind, "code": kind}}, headers)
+
+    def _send(self, status: int, body: dict, headers: Optional[dict] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def start_server(model: Optional[MockModel] = None, host: str = "127.0.0.1", port: int = 0,
+                 verbose: bool = False) -> ThreadingHTTPServer:
+    """
+    Starts an OpenAI-compatible mock server on a daemon thread; port 0 picks a
+    free port. Point a client at it with OpenAI(base_url=base_url(server), api_key="mock").
+    """
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.mock_model = model or MockModel()
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock model server for the evaluation harnesses")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit", type=float, default=None, help="requests per second before 429s")
+    parser.add_argument("--corruption", type=float, default=0.0, help="fraction of answers with a mistake")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    parser.add_argument("--run", metavar="MODULE",
+                        help="run a harness module (e.g. lisp_tests) against the server, then exit")
+    args = parser.parse_args()
+
+    server = start_server(MockModel(args.latency, args.jitter, args.error_rate, args.rate_limit,
+                                    args.corruption, args.seed), args.host, args.port, args.verbose)
+    os.environ[MOCK_API] = base_url(server)
+    if args.run:
+        runpy.run_module(args.run, run_name="__main__", alter_sys=True)
+    else:
+        print(f"Mock server listening; run the harnesses with {MOCK_API}={base_url(server)}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    server.shutdown()
@@ -1,19 +1,67 @@
-import matplotlib.pyplot as plt
-from typing import List, Dict, Tuple
+import asyncio
+from typing import List, Dict, Optional, Tuple
 from lisp_tests import test_gpt_expression_conversion as test_lisp
+from lisp_tests import test_gpt_expression_conversion_async as test_lisp_async
+from lisp_tests import PROMPT_FILE as LISP_PROMPT_FILE, describe_case as describe_lisp_case
 from expression_tests import test_gpt_expression_conversion as test_expr
+from expression_tests import test_gpt_expression_conversion_async as test_expr_async
+from expression_tests import PROMPT_FILE as EXPR_PROMPT_FILE, describe_case as describe_expr_case
+from api_client import response_cache
+from harness import grade_expression, grade_lisp, grade_responses
+from batch_runner import BatchRequest, OpenAIBatchBackend, run_batch
+from corpus import open_corpus
+import os
 
-def run_model_comparison_tests(models: List[str], num_tests: int = 25):
+# Batch API requests are billed at half the price of synchronous ones
+BATCH_DISCOUNT = 0.5
+
+def run_batch_sweep(model: str, cases: Dict[Tuple[str, int], list], batch, batch_dir: str = "batches",
+                    poll_interval: float = 30.0) -> Dict[Tuple[str, int], list]:
+    """
+    Sends every request of one model's sweep as a single batch and joins the answers back to the cases.
+
+    Args:
+        model: Model ID
+        cases: ('lisp' or 'expr', depth) -> test cases
+        batch: Batch backend (batch_runner.OpenAIBatchBackend or LocalBatchBackend)
+        batch_dir: Where to write the batch input file
+        poll_interval: Seconds between status checks
+
+    Returns:
+        dict: ('lisp' or 'expr', depth) -> one response (or exception) per case, in case order
+    """
+    system_messages = {'lisp': open(LISP_PROMPT_FILE).read(), 'expr': open(EXPR_PROMPT_FILE).read()}
+    requests = [
+        BatchRequest(f"{fmt}-{depth}-{i}", model, system_messages[fmt],
+                     generated.lisp_infix if fmt == 'lisp' else generated.infix)
+        for (fmt, depth), fmt_cases in cases.items() for i, generated in enumerate(fmt_cases)
+    ]
+    os.makedirs(batch_dir, exist_ok=True)
+    print(f"\nSubmitting {len(requests)} requests for {model} as a batch...")
+    results = run_batch(requests, batch, os.path.join(batch_dir, f"{model}.jsonl"),
+                        cache=response_cache(), poll_interval=poll_interval)
+    return {key: [results[f"{key[0]}-{key[1]}-{i}"] for i in range(len(fmt_cases))]
+            for key, fmt_cases in cases.items()}
+
+def run_model_comparison_tests(models: List[str], num_tests: int = 25, corpus_dir: str = "corpus",
+                               concurrency: Optional[int] = None, batch=None, batch_dir: str = "batches"):
     """
     Runs comparison tests across different GPT models.
     
     Args:
         models: List of model IDs to test (e.g., ["gpt-3.5-turbo", "gpt-4"])
         num_tests: Number of tests to run per depth level
+        corpus_dir: Corpus of distinct trees every model and format is tested on; built there if missing
+        concurrency: If set, send up to this many requests at once per test (asyncio)
+        batch: If set, a batch backend (batch_runner.OpenAIBatchBackend(get_client(cache=False))
+            for the Batch API, or a LocalBatchBackend) to send each model's whole sweep through
+            as one batch; the answers are graded once it completes
+        batch_dir: Where batch input files are written
     """
     print("\nRunning model comparison tests across depths 1-6:")
     
     depths = range(1, 7)
+    corpus = open_corpus(corpus_dir, depths, num_tests, dedupe=True)
     results: Dict[str, Dict[str, List[float]]] = {}
     evaluable_counts: Dict[str, Dict[str, List[int]]] = {}
     total_costs: Dict[str, float] = {}
@@ -31,22 +79,50 @@ def run_model_comparison_tests(models: List[str], num_tests: int = 25):
         }
         total_tokens = 0
         
+        cases = {}
+        for depth in depths:
+            cases['lisp', depth] = corpus.cases(depth, num_tests, true_division=True)
+            cases['expr', depth] = corpus.cases(depth, num_tests)  # fewer than num_tests where a depth has few distinct trees
+        if batch is not None:
+            batch_responses = run_batch_sweep(model, cases, batch, batch_dir)
+        
         # Run tests for each depth
         for depth in depths:
             print(f"\nTesting {model} at depth {depth}:")
             
+            lisp_cases = cases['lisp', depth]
+            expr_cases = cases['expr', depth]
+            
             print("Testing Lisp expressions...")
-            lisp_value, lisp_code, lisp_tokens, lisp_eval = test_lisp(
-                num_tests, depth, model=model
-            )
+            if batch is not None:
+                lisp_value, lisp_code, lisp_tokens, lisp_eval = grade_responses(
+                    lisp_cases, batch_responses['lisp', depth], grade_lisp, describe_lisp_case
+                )
+            elif concurrency:
+                lisp_value, lisp_code, lisp_tokens, lisp_eval = asyncio.run(test_lisp_async(
+                    len(lisp_cases), depth, model=model, cases=lisp_cases, concurrency=concurrency
+                ))
+            else:
+                lisp_value, lisp_code, lisp_tokens, lisp_eval = test_lisp(
+                    len(lisp_cases), depth, model=model, cases=lisp_cases
+                )
             results[model]['lisp_value_rates'].append(lisp_value)
             results[model]['lisp_code_rates'].append(lisp_code)
             evaluable_counts[model]['lisp'].append(lisp_eval)
             
             print("\nTesting Standard expressions...")
-            expr_value, expr_code, expr_tokens, expr_eval = test_expr(
-                num_tests, depth, model=model
-            )
+            if batch is not None:
+                expr_value, expr_code, expr_tokens, expr_eval = grade_responses(
+                    expr_cases, batch_responses['expr', depth], grade_expression, describe_expr_case
+                )
+            elif concurrency:
+                expr_value, expr_code, expr_tokens, expr_eval = asyncio.run(test_expr_async(
+                    len(expr_cases), depth, model=model, cases=expr_cases, concurrency=concurrency
+                ))
+            else:
+                expr_value, expr_code, expr_tokens, expr_eval = test_expr(
+                    len(expr_cases), depth, model=model, cases=expr_cases
+                )
             results[model]['expr_value_rates'].append(expr_value)
             results[model]['expr_code_rates'].append(expr_code)
             evaluable_counts[model]['expr'].append(expr_eval)
@@ -58,6 +134,8 @@ def run_model_comparison_tests(models: List[str], num_tests: int = 25):
             total_costs[model] = (total_tokens * 0.03 / 1_000) + (total_tokens * 0.06 / 1_000)
         else:  # gpt-3.5-turbo
             total_costs[model] = (total_tokens * 0.0015 / 1_000) + (total_tokens * 0.002 / 1_000)
+        if isinstance(batch, OpenAIBatchBackend):
+            total_costs[model] *= BATCH_DISCOUNT
             
         print(f"\nTotal cost for {model}: ${total_costs[model]:.6f}")
         
@@ -0,0 +1,118 @@
+from typing import NamedTuple, Tuple
+from expressions import Number, Var, Add, Sub, Mul, Div, Expr, ExprInterner
+
+class OptimizeStats(NamedTuple):
+    nodes_before: int          # size of the input as a tree (shared subtrees counted every time)
+    nodes_after: int           # distinct nodes in the optimized DAG
+    constants_folded: int      # operator nodes replaced by their constant value
+    identities_removed: int    # x+0, x-0, x*1, x/1, x-x, x*0 rewrites
+    subtrees_shared: int       # nodes that turned out to duplicate an earlier subtree
+
+    @property
+    def reduction(self) -> float:
+        """Fraction of tree nodes removed by optimizing."""
+        return 1 - self.nodes_after / self.nodes_before if self.nodes_before else 0.0
+
+def _is_const(node: Expr, value: int) -> bool:
+    return isinstance(node, Number) and node.value == value
+
+def optimize(expr: Expr, fold_constants: bool = True, eliminate_identities: bool = True,
+             interner: ExprInterner = None) -> Tuple[Expr, OptimizeStats]:
+    """
+    Shrinks an expression tree into a smaller equivalent DAG.
+
+    Runs a single post-order pass that folds constant subtrees, removes
+    algebraic identities, and hash-conses every result so common subexpressions
+    become one shared node. Rewrites never hide a division by zero: x-x and x*0
+    only become 0 when x can't raise, and constant divisions by zero stay as they are.
+
+    Args:
+        expr (Expr): The expression to optimize
+        fold_constants (bool): Replace operators on constants with their value
+        eliminate_identities (bool): Apply the x+0, x*1, x-x, ... rewrites
+        interner (ExprInterner, optional): Share nodes with an existing pool,
+            e.g. to optimize a whole corpus into one DAG
+
+    Returns:
+        tuple[Expr, OptimizeStats]: The optimized expression and what changed
+    """
+    if interner is None:
+        interner = ExprInterner()
+    done = {}        # id(input node) -> optimized node
+    may_raise = {}   # id(optimized node) -> whether evaluating it can divide by zero
+    tree_size = {}   # id(input node) -> size of that subtree as a tree
+    folded = identities = shared = 0
+
+    stack = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if id(node) in done:
+            continue
+        if isinstance(node, (Number, Var)):
+            result = interner.number(node.value) if isinstance(node, Number) else interner.var(node.name)
+            done[id(node)] = result
+            tree_size[id(node)] = 1
+            may_raise[id(result)] = False
+            continue
+        if not children_done:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+            continue
+
+        left, right = done[id(node.left)], done[id(node.right)]
+        tree_size[id(node)] = 1 + tree_size[id(node.left)] + tree_size[id(node.right)]
+        op = type(node)
+        raises = may_raise[id(left)] or may_raise[id(right)]
+        result = None
+
+        if fold_constants and isinstance(left, Number) and isinstance(right, Number) and not (op is Div and right.value == 0):
+            result = interner.number(op(left, right).eval())
+            folded += 1
+        elif eliminate_identities:
+            right_identity = 0 if op in (Add, Sub) else 1
+            left_identity = {Add: 0, Mul: 1}.get(op)
+            if _is_const(right, right_identity):
+                result = left
+            elif left_identity is not None and _is_const(left, left_identity):
+                result = right
+            elif op is Sub and left is right and not raises:
+                result = interner.number(0)
+            elif op is Mul and (_is_const(left, 0) or _is_const(right, 0)) and not raises:
+                result = interner.number(0)
+            if result is not None:
+                identities += 1
+
+        if result is None:
+            size = len(interner)
+            result = interner.make(op, left, right)
+            if len(interner) == size:
+                shared += 1
+            may_raise[id(result)] = raises or (op is Div and not (isinstance(right, Number) and right.value != 0))
+        else:
+            # Either an operand (already tracked) or a new constant
+            may_raise.setdefault(id(result), False)
+        done[id(node)] = result
+
+    optimized = done[id(expr)]
+    return optimized, OptimizeStats(
+        nodes_before=tree_size[id(expr)],
+        nodes_after=count_nodes(optimized),
+        constants_folded=folded,
+        identities_removed=identities,
+        subtrees_shared=shared,
+    )
+
+def count_nodes(expr: Expr) -> int:
+    """Counts the distinct node objects reachable from expr."""
+    seen = set()
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if not isinstance(node, (Number, Var)):
+            stack.append(node.left)
+            stack.append(node.right)
+    return len(seen)
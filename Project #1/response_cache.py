@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+from typing import Optional
+
+class CachedResponse:
+    """
+    The parts of a chat completion the harnesses read: choices[0].message.content and usage.
+
+    cached is True when the response came from the cache rather than the API,
+    so no tokens were paid for it.
+    """
+
+    def __init__(self, content: str, prompt_tokens: int, completion_tokens: int, model: str, cached: bool):
+        self.choices = [SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))]
+        self.usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                     total_tokens=prompt_tokens + completion_tokens)
+        self.model = model
+        self.cached = cached
+
+    @classmethod
+    def from_response(cls, response, model: str) -> "CachedResponse":
+        usage = response.usage
+        return cls(response.choices[0].message.content, usage.prompt_tokens if usage else 0,
+                   usage.completion_tokens if usage else 0, model, cached=False)
+
+def request_key(model: str, messages: list, **params) -> str:
+    """
+    The cache key of a chat completion request.
+
+    System messages are reduced to a hash of their text (the prompt file's
+    contents), so the key changes whenever a prompt file is edited; user
+    messages and every sampling parameter are part of the key as they are.
+    """
+    parts = []
+    for message in messages:
+        content = message["content"]
+        if message["role"] == "system":
+            content = hashlib.sha256(content.encode()).hexdigest()
+        parts.append([message["role"], content])
+    payload = json.dumps({"model": model, "messages": parts, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ResponseCache:
+    """
+    SQLite-backed store of chat completions, safe to share between threads.
+
+    Entries older than max_age seconds are ignored and dropped, and once
+    there are more than max_entries the least recently used ones are dropped.
+
+        cache = ResponseCache("cache/responses.sqlite", max_age=30 * 24 * 3600)
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = 100_000, max_age: Optional[float] = None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            content TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            created REAL NOT NULL,
+            last_used REAL NOT NULL
+        )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content, prompt_tokens, completion_tokens, model, created FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None or (self.max_age is not None and row[4] < now - self.max_age):
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return CachedResponse(row[0], row[1], row[2], row[3], cached=True)
+
+    def put(self, key: str, response: CachedResponse):
+        now = time.time()
+        usage = response.usage
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, response.model, response.choices[0].message.content,
+                 usage.prompt_tokens, usage.completion_tokens, now, now))
+            self._evict(now)
+
+    def _evict(self, now: float):
+        if self.max_age is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+        if self.max_entries is not None:
+            excess = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class CachedClient:
+    """
+    Wraps an OpenAI client so client.chat.completions.create() is answered from
+    a ResponseCache when it can be.
+
+    Identical requests made from several threads while the first is still in
+    flight wait for that one call instead of sending their own.
+    """
+
+    def __init__(self, client, cache: ResponseCache):
+        self.client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def create(self, model: str, messages: list, **params) -> CachedResponse:
+        key = request_key(model, messages, **params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            response = CachedResponse.from_response(
+                self.client.chat.completions.create(model=model, messages=messages, **params), model)
+            self.cache.put(key, response)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+class AsyncCachedClient:
+    """
+    The asyncio counterpart of CachedClient, wrapping an AsyncOpenAI client.
+
+    Concurrent identical requests on the event loop share one call. Used as an
+    async context manager it closes the wrapped client on exit.
+    """
+
+    def __init__(self, client, cache: ResponseCache):
+        self.client = client
+        self.cache = cache
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self._inflight = {}
+
+    async def create(self, model: str, messages: list, **params) -> CachedResponse:
+        key = request_key(model, messages, **params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = CachedResponse.from_response(
+                await self.client.chat.completions.create(model=model, messages=messages, **params), model)
+            self.cache.put(key, response)
+            pending.set_result(response)
+            return response
+        except BaseException as e:
+            pending.set_exception(e)
+            pending.exception()  # mark it retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def __aenter__(self):
+        await self.client.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.__aexit__(*exc)
@@ -0,0 +1,148 @@
+import operator
+import random
+from typing import List, Mapping, Optional, Tuple
+from expressions import Number, Add, Sub, Mul, Div, truncating_div
+from generators import OPERATORS, GeneratedExpression, generated_from
+
+# _leaf_probability[d]: chance that a uniformly random tree of depth <= d is a
+# single number, i.e. 1 / T(d) with T(1) = 1 and T(d) = 1 + T(d - 1)^2 shapes
+_leaf_probability = [1.0, 1.0]
+_shape_counts = [1, 1]
+
+def _leaf_chance(depth: int) -> float:
+    while len(_leaf_probability) <= depth:
+        count = 1 + _shape_counts[-1] ** 2
+        # Past 2^1100 shapes the chance is below the smallest float anyway; stop growing the integers
+        _shape_counts.append(count if count < 1 << 1100 else _shape_counts[-1])
+        _leaf_probability.append(1 / count if count < 1 << 1100 else 0.0)
+    return _leaf_probability[depth]
+
+def _remy_shape(internal_nodes: int, rng) -> Tuple[List[int], List[int], int]:
+    """
+    A full binary tree shape drawn uniformly among those with the given number
+    of operator nodes (Rémy's algorithm), as left/right child lists (-1 for a
+    leaf) and the root index.
+    """
+    left, right, parent = [-1], [-1], [-1]
+    root = 0
+    for _ in range(internal_nodes):
+        # Graft a new operator node above a uniformly chosen node, with a new leaf on a random side
+        x = rng.randrange(len(left))
+        node, leaf = len(left), len(left) + 1
+        above = parent[x]
+        if above == -1:
+            root = node
+        elif left[above] == x:
+            left[above] = node
+        else:
+            right[above] = node
+        if rng.random() < 0.5:
+            left += [x, -1]
+            right += [leaf, -1]
+        else:
+            left += [leaf, -1]
+            right += [x, -1]
+        parent += [above, node]
+        parent[x] = node
+    return left, right, root
+
+def _depth_shape(max_depth: int, rng) -> Tuple[List[int], List[int], int, int]:
+    """A shape drawn uniformly among those of depth <= max_depth, plus its actual depth."""
+    left, right = [], []
+    depth = 0
+    stack = [(-1, None, max_depth, 1)]  # (parent, side, depth budget, level)
+    while stack:
+        parent, side, budget, level = stack.pop()
+        node = len(left)
+        left.append(-1)
+        right.append(-1)
+        if parent != -1:
+            (left if side == 0 else right)[parent] = node
+        depth = max(depth, level)
+        if rng.random() >= _leaf_chance(budget):
+            stack.append((node, 1, budget - 1, level + 1))
+            stack.append((node, 0, budget - 1, level + 1))
+    return left, right, 0, depth
+
+def _build(left: List[int], right: List[int], root: int, rng, weights: Optional[Mapping[type, float]],
+           true_division: bool) -> GeneratedExpression:
+    """Labels a shape with random operators and numbers 1-10, keeping the shape and tracking values."""
+    ops = list(OPERATORS)
+    op_weights = [1.0] * len(ops) if weights is None else [float(weights.get(op, 0.0)) for op in ops]
+    if not any(op_weights):
+        raise ValueError("at least one operator needs a positive weight")
+    safe = [op for op in ops if op is not Div]
+    safe_weights = [w for op, w in zip(ops, op_weights) if op is not Div]
+    if not any(safe_weights):
+        safe_weights = [1.0] * len(safe)
+    apply = {Add: operator.add, Sub: operator.sub, Mul: operator.mul,
+             Div: operator.truediv if true_division else truncating_div}
+
+    internal = sum(1 for child in left if child != -1)
+    chosen = iter(rng.choices(ops, weights=op_weights, k=internal))
+    done = []
+    stack = [(root, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if left[node] == -1:
+            value = rng.randint(1, 10)
+            done.append((Number(value), value))
+        elif not children_done:
+            stack.append((node, True))
+            stack.append((right[node], False))
+            stack.append((left[node], False))
+        else:
+            (a_tree, a), (b_tree, b) = done[-2], done[-1]
+            del done[-2:]
+            op = next(chosen)
+            if op is Div and b == 0:
+                # Swapping the operator keeps the tree's size and shape exact
+                op = rng.choices(safe, weights=safe_weights)[0]
+            done.append((op(a_tree, b_tree), apply[op](a, b)))
+    return generated_from(*done[0])
+
+def sample_by_size(size: int, rng=random, weights: Optional[Mapping[type, float]] = None,
+                   true_division: bool = False) -> GeneratedExpression:
+    """
+    Draws a tree with exactly size nodes, its shape uniform among all such trees.
+
+    Operators are drawn independently with the given weights (uniform by
+    default) and numbers uniformly from 1-10. A division whose divisor is
+    worth 0 gets another operator instead, so the size stays exact. Runs in
+    time linear in size.
+
+    Args:
+        size (int): Total node count; odd, since every operator has two operands
+        rng: Source of randomness, e.g. random.Random(seed)
+        weights (dict, optional): Relative weight per operator class, e.g. {Add: 2, Div: 0.5}
+        true_division (bool): Track values as lisp_ast does instead of as Expr does
+
+    Returns:
+        GeneratedExpression: The tree, its value and all renderings
+    """
+    if size < 1 or size % 2 == 0:
+        raise ValueError(f"a tree has an odd, positive number of nodes, not {size}")
+    left, right, root = _remy_shape(size // 2, rng)
+    return _build(left, right, root, rng, weights, true_division)
+
+def sample_by_depth(min_depth: int, max_depth: Optional[int] = None, rng=random,
+                    weights: Optional[Mapping[type, float]] = None,
+                    true_division: bool = False) -> GeneratedExpression:
+    """
+    Draws a tree whose shape is uniform among all shapes with depth in [min_depth, max_depth].
+
+    Unlike the complete trees from generate_expression, these vary in size
+    and balance. Each node becomes a leaf with the precomputed probability
+    that a uniform tree of the remaining depth budget is a single number, so a
+    draw takes expected time linear in its size; shapes shallower than
+    min_depth are redrawn (at most about half the time, when min_depth ==
+    max_depth). Operators and numbers are drawn as in sample_by_size.
+    """
+    if max_depth is None:
+        max_depth = min_depth
+    if not 1 <= min_depth <= max_depth:
+        raise ValueError(f"need 1 <= min_depth <= max_depth, got {min_depth} and {max_depth}")
+    while True:
+        left, right, root, depth = _depth_shape(max_depth, rng)
+        if depth >= min_depth:
+            return _build(left, right, root, rng, weights, true_division)
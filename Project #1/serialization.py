@@ -0,0 +1,330 @@
+import mmap
+import struct
+from typing import Iterator, Union
+from expressions import Number, Var, Add, Sub, Mul, Div, Expr
+
+# Expr opcodes
+EXPR_NUMBER, EXPR_ADD, EXPR_SUB, EXPR_MUL, EXPR_DIV, EXPR_VAR = range(6)
+# Lisp opcodes, kept apart from the Expr ones so every record says what it holds
+LISP_LIST, LISP_INT, LISP_FLOAT, LISP_SYMBOL = range(0x10, 0x14)
+
+_EXPR_OPCODES = {Add: EXPR_ADD, Sub: EXPR_SUB, Mul: EXPR_MUL, Div: EXPR_DIV}
+_EXPR_CLASSES = {code: cls for cls, code in _EXPR_OPCODES.items()}
+
+_FLOAT = struct.Struct('<d')
+
+def _write_varint(out: bytearray, n: int):
+    """Appends a non-negative integer, 7 bits per byte, high bit meaning 'more follows'."""
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(data, pos: int):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+def _write_int(out: bytearray, n: int):
+    # Zigzag so small negative numbers stay small: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...
+    _write_varint(out, n * 2 if n >= 0 else -n * 2 - 1)
+
+def _read_int(data, pos: int):
+    n, pos = _read_varint(data, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+def _write_str(out: bytearray, s: str):
+    raw = s.encode('utf-8')
+    _write_varint(out, len(raw))
+    out += raw
+
+def _read_str(data, pos: int):
+    length, pos = _read_varint(data, pos)
+    return bytes(data[pos:pos + length]).decode('utf-8'), pos + length
+
+def encode_expr(expr: Expr) -> bytes:
+    """
+    Encodes an expression tree as pre-order opcodes.
+
+    Operators take one byte, numbers one byte plus a zigzag varint, and
+    variables one byte plus a length-prefixed name. Shared subtrees are written
+    out in full wherever they occur.
+    """
+    out = bytearray()
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Number):
+            out.append(EXPR_NUMBER)
+            _write_int(out, node.value)
+        elif isinstance(node, Var):
+            out.append(EXPR_VAR)
+            _write_str(out, node.name)
+        else:
+            out.append(_EXPR_OPCODES[type(node)])
+            stack.append(node.right)
+            stack.append(node.left)
+    return bytes(out)
+
+def decode_expr(data, pos: int = 0) -> Expr:
+    """Rebuilds an expression from encode_expr() output; data may be any bytes-like object."""
+    return _decode_expr(data, pos)[0]
+
+def _decode_expr(data, pos: int):
+    pending = []  # [operator class, left operand or None] waiting for their operands
+    while True:
+        code = data[pos]
+        pos += 1
+        if code == EXPR_NUMBER:
+            value, pos = _read_int(data, pos)
+            node = Number(value)
+        elif code == EXPR_VAR:
+            name, pos = _read_str(data, pos)
+            node = Var(name)
+        elif code in _EXPR_CLASSES:
+            pending.append([_EXPR_CLASSES[code], None])
+            continue
+        else:
+            raise ValueError(f"Bad Expr opcode {code} at byte {pos - 1}")
+
+        # A finished operand completes every operator that was waiting on its right side
+        while pending:
+            frame = pending[-1]
+            if frame[1] is None:
+                frame[1] = node
+                break
+            pending.pop()
+            node = frame[0](frame[1], node)
+        if not pending:
+            return node, pos
+
+def encode_lisp(x) -> bytes:
+    """Encodes a parsed lisp_ast expression (nested lists of ints, floats and symbols)."""
+    out = bytearray()
+    stack = [x]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, list):
+            out.append(LISP_LIST)
+            _write_varint(out, len(item))
+            stack.extend(reversed(item))
+        elif isinstance(item, str):
+            out.append(LISP_SYMBOL)
+            _write_str(out, item)
+        elif isinstance(item, int):
+            out.append(LISP_INT)
+            _write_int(out, item)
+        elif isinstance(item, float):
+            out.append(LISP_FLOAT)
+            out += _FLOAT.pack(item)
+        else:
+            raise TypeError(f"Can't encode {type(item).__name__} in a Lisp expression")
+    return bytes(out)
+
+def decode_lisp(data, pos: int = 0):
+    """Rebuilds a parsed Lisp expression from encode_lisp() output."""
+    return _decode_lisp(data, pos)[0]
+
+def _decode_lisp(data, pos: int):
+    pending = []  # [list being filled, number of items still missing]
+    while True:
+        code = data[pos]
+        pos += 1
+        if code == LISP_LIST:
+            count, pos = _read_varint(data, pos)
+            if count:
+                pending.append([[], count])
+                continue
+            item = []
+        elif code == LISP_INT:
+            item, pos = _read_int(data, pos)
+        elif code == LISP_FLOAT:
+            item = _FLOAT.unpack_from(data, pos)[0]
+            pos += _FLOAT.size
+        elif code == LISP_SYMBOL:
+            item, pos = _read_str(data, pos)
+        else:
+            raise ValueError(f"Bad Lisp opcode {code} at byte {pos - 1}")
+
+        while pending:
+            frame = pending[-1]
+            frame[0].append(item)
+            frame[1] -= 1
+            if frame[1]:
+                break
+            pending.pop()
+            item = frame[0]
+        if not pending:
+            return item, pos
+
+def encode(tree: Union[Expr, list, int, float, str]) -> bytes:
+    """Encodes either an Expr or a parsed Lisp expression."""
+    return encode_expr(tree) if isinstance(tree, Expr) else encode_lisp(tree)
+
+def decode(data, pos: int = 0):
+    """Decodes a record written by encode(), telling Expr and Lisp apart by the first opcode."""
+    return decode_expr(data, pos) if data[pos] < LISP_LIST else decode_lisp(data, pos)
+
+# Corpus file layout:
+#   MAGIC | record 0 | record 1 | ... | padding to 8 bytes |
+#   index: (count + 1) little-endian uint64 record offsets, the last one marking the end of the records |
+#   footer: uint64 index offset | uint64 count | MAGIC
+MAGIC = b'EXPRCRP1'
+_FOOTER = struct.Struct('<QQ8s')
+_OFFSET = struct.Struct('<Q')
+
+class CorpusWriter:
+    """
+    Appends encoded trees to a corpus file and writes its offset index on close.
+
+        with CorpusWriter("depth6.corpus") as writer:
+            for tree in trees:
+                writer.append(tree)
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._offsets = []
+        self._pos = len(MAGIC)
+
+    def append(self, tree) -> int:
+        """Writes one Expr or Lisp expression and returns its index in the corpus."""
+        record = encode(tree)
+        self._offsets.append(self._pos)
+        self._file.write(record)
+        self._pos += len(record)
+        return len(self._offsets) - 1
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._offsets.append(self._pos)  # end of the last record
+        padding = -self._pos % 8
+        self._file.write(b'\0' * padding)
+        index_offset = self._pos + padding
+        for offset in self._offsets:
+            self._file.write(_OFFSET.pack(offset))
+        self._file.write(_FOOTER.pack(index_offset, len(self._offsets) - 1, MAGIC))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CorpusReader:
+    """
+    Random access to a corpus file through mmap.
+
+    Nothing is read up front: the index is a view onto the mapped file, and
+    raw(i) hands out a zero-copy memoryview of record i, so several worker
+    processes can map the same file and pull trees by index.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        if bytes(self._view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a corpus file")
+        index_offset, count, magic = _FOOTER.unpack_from(self._map, len(self._map) - _FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} has no corpus index (was the writer closed?)")
+        self._count = count
+        self._index_offset = index_offset
+
+    def __len__(self) -> int:
+        return self._count
+
+    def raw(self, i: int) -> memoryview:
+        """The encoded bytes of record i, without copying."""
+        if self._map is None:
+            raise ValueError("I/O operation on closed corpus")
+        if not -self._count <= i < self._count:
+            raise IndexError("corpus index out of range")
+        i %= self._count
+        start, end = struct.unpack_from('<QQ', self._map, self._index_offset + _OFFSET.size * i)
+        return self._view[start:end]
+
+    def __getitem__(self, i: int):
+        return decode(self.raw(i))
+
+    def __iter__(self) -> Iterator:
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self):
+        """
+        Closes the corpus. Views returned by raw() stay valid after this: if any
+        are still alive, the file stays mapped until the last one is released
+        or garbage collected.
+        """
+        if self._map is None:
+            return
+        try:
+            self._view.release()
+            self._map.close()
+        except BufferError:
+            pass  # raw() views still export the map; dropping our references leaves it to them
+        finally:
+            self._view = self._map = None
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def test_close_with_live_view():
+    """Test that closing a CorpusReader while a raw() view is alive closes the file and keeps the view usable"""
+    import os
+    import tempfile
+    from expressions import Add, Number
+
+    tree = Add(Number(1), Number(2))
+    fd, path = tempfile.mkstemp(suffix='.corpus')
+    os.close(fd)
+    try:
+        with CorpusWriter(path) as writer:
+            writer.append(tree)
+        reader = CorpusReader(path)
+        view = reader.raw(0)
+        reader.close()
+        checks = [
+            ("close() with a live view closes the file", reader._file.closed),
+            ("the view still decodes after close()", decode(view) == tree),
+            ("raw() after close() raises ValueError", _raises(ValueError, reader.raw, 0)),
+            ("a second close() does nothing", reader.close() is None),
+        ]
+        view.release()
+    finally:
+        os.remove(path)
+
+    passed = sum(ok for _, ok in checks)
+    for name, ok in checks:
+        print(f"{'PASS' if ok else 'FAIL'}: {name}")
+    print(f"\nTest Summary:")
+    print(f"Passed: {passed}")
+    print(f"Failed: {len(checks) - passed}")
+    print(f"Total: {len(checks)}")
+
+def _raises(exception, fn, *args) -> bool:
+    try:
+        fn(*args)
+    except exception:
+        return True
+    return False
+
+if __name__ == "__main__":
+    test_close_with_live_view()
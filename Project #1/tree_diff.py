@@ -0,0 +1,273 @@
+from typing import List, NamedTuple, Optional, Tuple
+from expressions import Number, Var, Expr
+import lisp_ast
+
+# Mismatch regions bigger than this (in nodes, both sides together) are scored
+# by aligned relabeling instead of the Zhang-Shasha algorithm, which takes tens
+# of milliseconds at this size and grows faster than quadratically
+MAX_EXACT_REGION = 256
+
+class _Node(NamedTuple):
+    label: object           # operator name, ('num', value) or ('var', name)
+    children: tuple
+    hash: int
+    size: int
+
+class TreeDiff(NamedTuple):
+    distance: int                           # tree edit distance (unit costs) over the mismatching regions
+    first_mismatch: Optional[Tuple[int, ...]]  # child-index path to the first differing subtree
+    classification: str                     # kind of the first mismatch, or 'identical'
+    mismatches: List[Tuple[Tuple[int, ...], str]]  # every (path, kind) in pre-order
+    expected_size: int
+    actual_size: int
+
+    @property
+    def identical(self) -> bool:
+        return self.distance == 0
+
+    @property
+    def similarity(self) -> float:
+        """Partial credit in [0, 1]: 1 - distance / size of the larger tree."""
+        return 1 - self.distance / max(self.expected_size, self.actual_size)
+
+def _leaf(label) -> _Node:
+    return _Node(label, (), hash(label), 1)
+
+def _branch(label, children: tuple) -> _Node:
+    return _Node(label, children, hash((label, tuple(c.hash for c in children))),
+                 1 + sum(c.size for c in children))
+
+def _from_expr(expr: Expr) -> _Node:
+    built = {}
+    stack = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if id(node) in built:
+            continue
+        if isinstance(node, Number):
+            built[id(node)] = _leaf(('num', node.value))
+        elif isinstance(node, Var):
+            built[id(node)] = _leaf(('var', node.name))
+        elif children_done:
+            built[id(node)] = _branch(node.lisp_name, (built[id(node.left)], built[id(node.right)]))
+        else:
+            stack.append((node, True))
+            stack.append((node.right, False))
+            stack.append((node.left, False))
+    return built[id(expr)]
+
+def _from_lisp(x) -> _Node:
+    results = []
+    stack = [(x, False)]
+    while stack:
+        item, children_done = stack.pop()
+        if not isinstance(item, list):
+            results.append(_leaf(('num', item) if isinstance(item, (int, float)) else ('var', item)))
+        elif len(item) == 2 and item[0] == 'number' and isinstance(item[1], (int, float)):
+            results.append(_leaf(('num', item[1])))
+        elif children_done:
+            has_head = bool(item) and isinstance(item[0], str)
+            count = len(item) - 1 if has_head else len(item)
+            children = tuple(results[len(results) - count:]) if count else ()
+            del results[len(results) - count:]
+            results.append(_branch(item[0] if has_head else '()', children))
+        else:
+            stack.append((item, True))
+            start = 1 if item and isinstance(item[0], str) else 0
+            stack.extend((child, False) for child in reversed(item[start:]))
+    return results[0]
+
+def _to_tree(x) -> _Node:
+    if isinstance(x, Expr):
+        return _from_expr(x)
+    if isinstance(x, str):
+        x = lisp_ast.parse(x)
+    return _from_lisp(x)
+
+def _same(a: _Node, b: _Node) -> bool:
+    """Whether two subtrees are equal; hashes only rule pairs out, since hash(-1) == hash(-2)."""
+    if a is b:
+        return True
+    stack = [(a, b)]
+    while stack:
+        x, y = stack.pop()
+        if x is y:
+            continue
+        if x.hash != y.hash or x.size != y.size or x.label != y.label or len(x.children) != len(y.children):
+            return False
+        stack.extend(zip(x.children, y.children))
+    return True
+
+def _postorder(root: _Node) -> List[_Node]:
+    nodes = []
+    stack = [(root, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if children_done or not node.children:
+            nodes.append(node)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+    return nodes
+
+def _zhang_shasha(a: _Node, b: _Node) -> int:
+    """Exact ordered tree edit distance with unit insert/delete/relabel costs."""
+    A, B = _postorder(a), _postorder(b)
+    # A subtree is contiguous in post-order, so its leftmost leaf sits size - 1 places back
+    la = [i - node.size + 1 for i, node in enumerate(A)]
+    lb = [j - node.size + 1 for j, node in enumerate(B)]
+    keyroots_a = sorted({l: i for i, l in enumerate(la)}.values())
+    keyroots_b = sorted({l: j for j, l in enumerate(lb)}.values())
+    treedist = [[0] * len(B) for _ in A]
+
+    for i in keyroots_a:
+        for j in keyroots_b:
+            li, lj = la[i], lb[j]
+            rows, cols = i - li + 2, j - lj + 2
+            forest = [[0] * cols for _ in range(rows)]
+            for x in range(1, rows):
+                forest[x][0] = x
+            for y in range(1, cols):
+                forest[0][y] = y
+            for x in range(1, rows):
+                ix = li + x - 1
+                for y in range(1, cols):
+                    jy = lj + y - 1
+                    if la[ix] == li and lb[jy] == lj:
+                        relabel = 0 if A[ix].label == B[jy].label else 1
+                        forest[x][y] = min(forest[x - 1][y] + 1, forest[x][y - 1] + 1,
+                                           forest[x - 1][y - 1] + relabel)
+                        treedist[ix][jy] = forest[x][y]
+                    else:
+                        forest[x][y] = min(forest[x - 1][y] + 1, forest[x][y - 1] + 1,
+                                           forest[la[ix] - li][lb[jy] - lj] + treedist[ix][jy])
+    return treedist[-1][-1]
+
+def _aligned_distance(a: _Node, b: _Node) -> int:
+    """Cost of an edit script that keeps the two shapes aligned; an upper bound on the edit distance."""
+    distance = 0
+    stack = [(a, b)]
+    while stack:
+        x, y = stack.pop()
+        if _same(x, y):
+            continue
+        distance += x.label != y.label
+        if len(x.children) == len(y.children):
+            stack.extend(zip(x.children, y.children))
+        else:
+            # Replace everything below: delete x's descendants, insert y's
+            distance += (x.size - 1) + (y.size - 1)
+    return distance
+
+def _region_distance(a: _Node, b: _Node) -> int:
+    if a.size + b.size > MAX_EXACT_REGION:
+        return _aligned_distance(a, b)
+    return _zhang_shasha(a, b)
+
+def _inorder_labels(root: _Node) -> list:
+    """Labels in reading order, i.e. the infix text with every parenthesis removed."""
+    labels = []
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded or not node.children:
+            labels.append(node.label)
+        elif len(node.children) == 2:
+            stack.append((node.children[1], False))
+            stack.append((node, True))
+            stack.append((node.children[0], False))
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+    return labels
+
+def _classify(a: _Node, b: _Node) -> str:
+    if not a.children and not b.children:
+        return 'wrong_number' if a.label[0] == b.label[0] == 'num' else 'wrong_leaf'
+    if len(a.children) == len(b.children) == 2:
+        left, right = a.children
+        if a.label == b.label and _same(left, b.children[1]) and _same(right, b.children[0]):
+            return 'swapped_operands'
+        if a.label != b.label and all(_same(x, y) for x, y in zip(a.children, b.children)):
+            return 'wrong_operator'
+    if a.size == b.size and _inorder_labels(a) == _inorder_labels(b):
+        return 'dropped_parentheses'
+    return 'structural'
+
+def compare(expected, actual) -> TreeDiff:
+    """
+    Structurally compares an expected tree with a generated one.
+
+    Works on Expr trees, parsed lisp_ast lists or Lisp source text (either side
+    may be either kind). Subtree hashes let identical regions be skipped in one
+    O(n) aligned walk; edit distance is only computed on the regions that
+    differ. Each differing region is classified as 'wrong_operator',
+    'swapped_operands', 'dropped_parentheses' (same tokens, different
+    grouping), 'wrong_number', 'wrong_leaf' or 'structural'.
+
+    Args:
+        expected: The reference tree
+        actual: The tree produced by the model
+
+    Returns:
+        TreeDiff: Edit distance, the first mismatching path, and all mismatches
+    """
+    a, b = _to_tree(expected), _to_tree(actual)
+    distance = 0
+    mismatches = []
+    stack = [((), a, b)]
+    while stack:
+        path, x, y = stack.pop()
+        if _same(x, y):
+            continue
+        if (x.children and len(x.children) == len(y.children)
+                and all(cx.size == cy.size for cx, cy in zip(x.children, y.children))
+                and not (x.label == y.label and len(x.children) == 2 and _same(x.children[0], y.children[1])
+                         and _same(x.children[1], y.children[0]))):
+            # Operands of the same shape, differing somewhere below or only in the operator:
+            # relabel (cost 1) if need be and keep walking in step, so identical operands are still skipped
+            if x.label != y.label:
+                mismatches.append((path, 'wrong_operator'))
+                distance += 1
+            for i in reversed(range(len(x.children))):
+                stack.append((path + (i,), x.children[i], y.children[i]))
+            continue
+        mismatches.append((path, _classify(x, y)))
+        distance += _region_distance(x, y)
+
+    first_path, first_kind = mismatches[0] if mismatches else (None, 'identical')
+    return TreeDiff(distance, first_path, first_kind, mismatches, a.size, b.size)
+
+def test_compare():
+    """Test compare on identical, wrong and colliding trees (CPython hashes -1 and -2 alike)"""
+    from expressions import Add, Mul
+    test_cases = [
+        (Add(Number(2), Number(3)), Add(Number(2), Number(3)), 'identical', 0),
+        (Number(-1), Number(-2), 'wrong_number', 1),
+        (Add(Number(-1), Number(3)), Add(Number(-2), Number(3)), 'wrong_number', 1),
+        (Mul(Add(Number(-2), Var('x')), Number(-1)), Mul(Add(Number(-1), Var('x')), Number(-2)), 'wrong_number', 2),
+        ("(add (number -1) (number 3))", "(add (number -2) (number 3))", 'wrong_number', 1),
+        (Add(Number(2), Number(3)), Mul(Number(2), Number(3)), 'wrong_operator', 1),
+        (Add(Number(2), Number(3)), Add(Number(3), Number(2)), 'swapped_operands', 2),
+    ]
+
+    passed = 0
+    failed = 0
+
+    for expected, actual, kind, distance in test_cases:
+        diff = compare(expected, actual)
+        if diff.classification == kind and diff.distance == distance:
+            print(f"PASS: {expected} vs {actual} → {kind}, distance {distance}")
+            passed += 1
+        else:
+            print(f"FAIL: {expected} vs {actual}, expected {kind} at distance {distance}, "
+                  f"got {diff.classification} at distance {diff.distance}")
+            failed += 1
+
+    print(f"\nTest Summary:")
+    print(f"Passed: {passed}")
+    print(f"Failed: {failed}")
+    print(f"Total: {passed + failed}")
+
+if __name__ == "__main__":
+    test_compare()